@@ -0,0 +1,204 @@
+# Stock Market Simulation
+
+# Here we time the hot paths of the simulator (simulation, option pricing and
+# plotting) with fixed seeds and parameters, e.g.
+#     python stock_bench.py --save bench_baseline.json
+#     python stock_bench.py --compare bench_baseline.json
+# Every benchmark reports its best time, its throughput and its peak memory;
+# comparing against a saved baseline flags the benchmarks that got slower
+
+import argparse, gc, json, math, sys, time, tracemalloc
+import numpy
+from stock_classes import *
+from stock_simulator import *
+
+# BENCHMARKS -------------------------------------------------------------------
+
+# Fixed parameters, taken from stock_plot
+S0 = 1000.0
+vol = 0.3
+rate = 0.04
+maturity = 365.0/12.0*4.0
+strike = S0*math.exp(maturity/365.0*rate)
+market = Market(rate, defaultTrends(vol))
+seed = 2011
+
+# --- timeIt ---
+# PURPOSE: runs func repeat times and returns the best time (in seconds) and
+#          the peak memory traced during one extra run (in bytes)
+# FUNCTION: Function + Nat -> Float + Nat
+
+def timeIt(func, repeat):
+    best = float('inf')
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+# --- benchmarks ---
+# PURPOSE: the list of benchmarks as (name, function, work done, unit); quick
+#          uses smaller sizes so the suite runs in a few seconds
+# FUNCTION: Boolean -> [Listof (String + Function + Nat + String)]
+
+def benchmarks(quick = False):
+    horizons = (365, 1460) if quick else (365, 1460, 3650)
+    counts = (1, 1000) if quick else (1, 1000, 10000)
+    chain = 10000 if quick else 100000
+    rng = numpy.random.default_rng(seed)
+    S = rng.uniform(0.8, 1.2, chain)*S0
+    K = rng.uniform(0.8, 1.2, chain)*strike
+    T = rng.uniform(1.0, 730.0, chain)
+    benches = []
+    for days in horizons:
+        benches.append(('runStockSim[days=%d]' % days,
+                        lambda days = days: runStockSim('B', S0, days, vol, market, True, True, seed),
+                        1, 'paths'))
+        benches.append(('runStockSim[days=%d,mo]' % days,
+                        lambda days = days: runStockSim('B', S0, days, vol, market, True, False, seed),
+                        1, 'paths'))
+        for n in counts:
+            benches.append(('simulatePaths[days=%d,paths=%d]' % (days, n),
+                            lambda days = days, n = n: simulatePaths(S0, days, vol, market,
+                                                                     False, True, n, seed),
+                            n, 'paths'))
+            benches.append(('simulatePaths[days=%d,paths=%d,mo]' % (days, n),
+                            lambda days = days, n = n: simulatePaths(S0, days, vol, market,
+                                                                     True, True, n, seed),
+                            n, 'paths'))
+    for pricer in (putPrice, callPrice):
+        benches.append(('%s[scalar]' % pricer.__name__,
+                        lambda pricer = pricer: [pricer(S0, k, maturity, rate, vol) for k in K[:1000]],
+                        1000, 'prices'))
+        benches.append(('%s[chain=%d]' % (pricer.__name__, chain),
+                        lambda pricer = pricer: pricer(S, K, T, rate, vol),
+                        chain, 'prices'))
+    benches.append(('optionGreeks[chain=%d]' % chain,
+                    lambda: optionGreeks(S, K, T, rate, vol), 2*chain, 'prices'))
+    # a miss starts from an empty cache, a hit finds every contract already there
+    warm = PricingCache(2*chain)
+    warm.prices(S, K, T, rate, vol)
+    for k in K[:1000]: warm.prices(S0, k, maturity, rate, vol)
+    def scalarPrices(cache):
+        return [cache.prices(S0, k, maturity, rate, vol) for k in K[:1000]]
+    benches.append(('PricingCache[scalar,miss]', lambda: scalarPrices(PricingCache()),
+                    1000, 'prices'))
+    benches.append(('PricingCache[scalar,hit]', lambda: scalarPrices(warm), 1000, 'prices'))
+    benches.append(('PricingCache[chain=%d,miss]' % chain,
+                    lambda: PricingCache().prices(S, K, T, rate, vol), 2*chain, 'prices'))
+    benches.append(('PricingCache[chain=%d,hit]' % chain,
+                    lambda: warm.prices(S, K, T, rate, vol), 2*chain, 'prices'))
+    # a chain of 100 contracts that are each quoted chain/100 times
+    repeated = numpy.repeat(K[:100], chain//100)
+    benches.append(('PricingCache[chain=%d,distinct=100]' % chain,
+                    lambda: PricingCache().prices(S0, repeated, maturity, rate, vol),
+                    2*chain, 'prices'))
+    return benches
+
+# --- plotBenchmarks ---
+# PURPOSE: the plotting benchmarks; pylab is set to a headless backend first
+# FUNCTION: Boolean -> [Listof (String + Function + Nat + String)]
+
+def plotBenchmarks(quick = False):
+    import matplotlib
+    matplotlib.use('Agg')
+    import pylab, stock_plot
+    numStks = 15 if quick else 100
+    def onFigure(plot):
+        def run():
+            fig = pylab.figure()
+            plot(fig)
+            fig.canvas.draw()
+            pylab.close(fig)
+        return run
+    benches = []
+    for var in ('Market Price', 'Strike Price', 'Risk-free-rate', 'Volatility',
+                'Maturity in Days'):
+        benches.append(('plotGreeks[%s]' % var,
+                        onFigure(lambda fig, var = var: stock_plot.plotGreeks(S0, strike, maturity, rate, vol, var, fig)),
+                        1, 'plots'))
+    benches.append(('plotOptions',
+                    onFigure(lambda fig: stock_plot.plotOptions('B', S0, strike, 1460, vol, market, False, True, fig)),
+                    1, 'plots'))
+    benches.append(('plotMulti[stocks=%d]' % numStks,
+                    onFigure(lambda fig: stock_plot.plotMulti(numStks, S0, 1460, vol, market, False, False, fig, seed)),
+                    numStks, 'paths'))
+    numEnsemble = 1000 if quick else 10000
+    for mode in ('collection', 'fan', 'density'):
+        benches.append(('plotMulti[stocks=%d,mode=%s]' % (numEnsemble, mode),
+                        onFigure(lambda fig, mode = mode: stock_plot.plotMulti(numEnsemble, S0, 1460, vol, market, False, False, fig, seed, mode = mode)),
+                        numEnsemble, 'paths'))
+    return benches
+
+# --- runBenchmarks ---
+# PURPOSE: runs the benchmarks whose names contain one of the given filters
+#          (all of them if there is none) and returns the results by name
+# FUNCTION: [Listof (String + Function + Nat + String)] + Nat + [Listof String]
+#           -> {String: {String: Any}}
+
+def runBenchmarks(benches, repeat = 3, filters = None):
+    results = {}
+    for name, func, work, unit in benches:
+        if filters and not any(f in name for f in filters): continue
+        seconds, peak = timeIt(func, repeat)
+        results[name] = {'seconds': seconds, 'throughput': work/seconds,
+                         'unit': unit + '/s', 'peakMB': peak/1e6}
+        sys.stderr.write('%-45s %10.5f s %14.1f %-9s %9.2f MB\n' %
+                         (name, seconds, work/seconds, unit + '/s', peak/1e6))
+    return results
+
+# --- compareResults ---
+# PURPOSE: prints a regression report of results against a baseline and
+#          returns the names of the benchmarks that are more than tolerance
+#          (as a fraction) slower than the baseline
+# FUNCTION: {String: {String: Any}} + {String: {String: Any}} + Float -> [Listof String]
+
+def compareResults(results, baseline, tolerance = 0.2):
+    slower = []
+    print('%-45s %10s %10s %8s' % ('benchmark', 'base (s)', 'now (s)', 'ratio'))
+    for name in sorted(results):
+        if name not in baseline:
+            print('%-45s %10s %10.5f %8s' % (name, '-', results[name]['seconds'], 'new'))
+            continue
+        ratio = results[name]['seconds']/baseline[name]['seconds']
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = 'SLOWER'
+            slower.append(name)
+        elif ratio < 1 - tolerance: flag = 'faster'
+        print('%-45s %10.5f %10.5f %8.2f %s' % (name, baseline[name]['seconds'],
+                                                results[name]['seconds'], ratio, flag))
+    return slower
+
+# COMMAND LINE -----------------------------------------------------------------
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the stock simulator.')
+    parser.add_argument('filters', nargs = '*', help = 'only run matching benchmarks')
+    parser.add_argument('--quick', action = 'store_true')
+    parser.add_argument('--no-plots', action = 'store_true')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--save', default = None, help = 'write the results as a baseline')
+    parser.add_argument('--compare', default = None, help = 'baseline to compare against')
+    parser.add_argument('--tolerance', type = float, default = 0.2)
+    args = parser.parse_args(argv)
+    benches = benchmarks(args.quick)
+    if not args.no_plots: benches += plotBenchmarks(args.quick)
+    results = runBenchmarks(benches, args.repeat, args.filters)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent = 1, sort_keys = True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compareResults(results, baseline, args.tolerance): return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
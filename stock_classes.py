@@ -11,9 +11,102 @@
 
 # HELPER FUNCTIONS -------------------------------------------------------------
 
-# The culmulative normal distribution function:
+import math, numpy, statistics
+
+# The types of plain numbers, which the pricing functions handle with math
+# instead of numpy (a 0-d array costs far more than the formula itself)
+scalars = (int, float, numpy.integer, numpy.floating)
+
+# The culmulative normal distribution function; works elementwise on arrays 
+# using Hart's approximation (as given by West, 2005) so that whole
+# option chains can be priced without calling math.erf once per value:
 def phi(x):
-    return 0.5*( 1.0 + math.erf(x/math.sqrt(2.0)) )
+    if isinstance(x, scalars): return 0.5*math.erfc(-x/math.sqrt(2.0))
+    x = numpy.asarray(x, dtype = float)
+    xAbs = numpy.abs(x).reshape(-1)
+    num = 3.52624965998911e-02*xAbs + 0.700383064443688
+    for c in (6.37396220353165, 33.912866078383, 112.079291497871,
+              221.213596169931, 220.206867912376):
+        num *= xAbs
+        num += c
+    den = 8.83883476483184e-02*xAbs + 1.75566716318264
+    for c in (16.064177579207, 86.7807322029461, 296.564248779674,
+              637.333633378831, 793.826512519948, 440.413735824752):
+        den *= xAbs
+        den += c
+    tail = numpy.exp(-xAbs*xAbs/2.0)
+    far = xAbs >= 7.07106781186547
+    if far.any():
+        frac = xAbs[far] + 0.65
+        for c in (4.0, 3.0, 2.0, 1.0):
+            frac = xAbs[far] + c/frac
+        num[far], den[far] = 1.0, 2.506628274631*frac
+    tail *= num
+    tail /= den
+    tail[xAbs > 37.0] = 0.0
+    tail = tail.reshape(x.shape)
+    return numpy.where(x > 0, 1.0 - tail, tail)[()]
+
+# The normal probability density function (the derivative of phi):
+def dphi(x):
+    return numpy.exp(-numpy.asarray(x, dtype = float)**2/2.0)/math.sqrt(2.0*math.pi)
+
+# The inverse of phi (the normal quantile function); Acklam's rational 
+# approximation refined with one step of Halley's method, elementwise on arrays:
+def invPhi(p):
+    p = numpy.asarray(p, dtype = float)
+    a = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+    b = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01, 1.0)
+    c = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+         -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+    d = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+         3.754408661907416e+00, 1.0)
+    x = numpy.full(p.shape, numpy.nan)
+    central = numpy.abs(p - 0.5) <= 0.5 - 0.02425
+    r = p[central] - 0.5
+    x[central] = r*numpy.polyval(a, r*r)/numpy.polyval(b, r*r)
+    tails = ~central & (p > 0.0) & (p < 1.0)
+    q = numpy.sqrt(-2.0*numpy.log(numpy.minimum(p[tails], 1.0 - p[tails])))
+    x[tails] = numpy.where(p[tails] < 0.5, 1.0, -1.0)*numpy.polyval(c, q)/numpy.polyval(d, q)
+    with numpy.errstate(over = 'ignore', invalid = 'ignore'):
+        e = (phi(x) - p)*math.sqrt(2.0*math.pi)*numpy.exp(x*x/2.0)
+        x = numpy.where(numpy.isfinite(x), x - e/(1.0 + x*e/2.0), x)
+    x = numpy.where(p <= 0.0, -numpy.inf, numpy.where(p >= 1.0, numpy.inf, x))
+    return x[()]
+
+# --- bsTerms ---
+# PURPOSE: computes the shared Black-Scholes terms for broadcastable inputs:
+#          the remaining time (in years), d1, d2 and the discount factor
+# FUNCTION: Float + Float + Float + Float + Float + Float 
+#           -> Float + Float + Float + Float
+
+def bsTerms(S, K, T, r, v, t = 0.0):
+    S, K, T, r, v, t = numpy.broadcast_arrays(*[numpy.asarray(a, dtype = float)
+                                                for a in (S, K, T, r, v, t)])
+    tau = numpy.maximum(T - t, 0.0)/365.0
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        volT = v*numpy.sqrt(tau)
+        d1 = (numpy.log(S/K) + (r + (v**2.0)/2.0)*tau) / volT
+    d2 = d1 - volT
+    return tau, d1, d2, numpy.exp(-r*tau)
+
+# --- scalarTerms ---
+# PURPOSE: bsTerms for plain numbers, with math; None if an input is an array 
+#          or the contract is at or past maturity or degenerate (those are left
+#          to the array code)
+# FUNCTION: Float + Float + Float + Float + Float + Float 
+#           -> Float + Float + Float + Float
+
+def scalarTerms(S, K, T, r, v, t = 0.0):
+    for a in (S, K, T, r, v, t):
+        if not isinstance(a, scalars): return None
+    tau = (T - t)/365.0
+    if not (tau > 0 and v > 0 and S > 0 and K > 0): return None
+    volT = v*math.sqrt(tau)
+    d1 = (math.log(S/K) + (r + v*v/2.0)*tau)/volT
+    return tau, d1, d1 - volT, math.exp(-r*tau)
 
 #--- mdToNum ---
 # PURPOSE: calculates the number of days that have passed in the year based on an
@@ -30,25 +123,135 @@ def mdToNum(months,days):
         total += days
         return total
     
+# --- defaultTrends ---
+# PURPOSE: the list of trends used by our simulations, scaled by the volatility
+# FUNCTION: Float -> [Listof Trend]
+
+def defaultTrends(v):
+    return [Trend('Christmas', mdToNum(12,25), 0.05*v),
+            Trend('Valentines Day', mdToNum(2,14), 0.005*v), 
+            Trend('March Break', mdToNum(3,10), 0.001*v), 
+            Trend('September $1^{st}$', mdToNum(9,1), -0.001*v), #; usually the lowest performing month
+            Trend('Black Monday', mdToNum(10,19), -0.005*v)]
+
 # --- stockPrice ---
-# PURPOSE: uses Ito's Lemma to generate a stock price
-# FUNCTION: Stock + Nat + Market -> Float
+# PURPOSE: uses Ito's Lemma to generate a stock price, p*exp((r - v^2/2)T) (the
+#          exponential of the expected log price); if numLoop is positive, the
+#          expected log price is instead estimated with mcStockPrice using at
+#          most numLoop simulated prices
+# FUNCTION: Stock + Nat + Market + Nat -> Float
 # Note that this is merely an estimation
 
-def stockPrice(Stk, T, M):
-    numLoop = 1000 # Adjust this number for accuracy
-    stocMean = 0
+def stockPrice(Stk, T, M, numLoop = 0):
+    if numLoop > 0: # Adjust this number for accuracy
+        return math.exp(mcStockPrice(Stk, T, M, kind = 'log', maxSamples = numLoop)['estimate'])
     r = M.getDrift()
     v = Stk.volatility
     p = Stk.price
     detComp = (r - v**2/2)*T/365.0
-    #for i in range(numLoop):  # Comment out if you do not wish for a Stochastic component
-        #stocMean += v*(random.gauss(0,1))*math.sqrt(T)*T/365.0
-    stocComp = stocMean / numLoop
-    return p*math.exp(detComp + stocComp)
+    return p*math.exp(detComp)
+
+# --- cvEstimate ---
+# PURPOSE: the control variate estimate of the mean of the first row of some 
+#          samples and its variance per sample, from the running sums s1 and s2
+#          of n samples; the other rows are controls with known means
+# FUNCTION: [Arrayof Float] + [Arrayof Float] + Nat + [Arrayof Float] + Boolean
+#           -> Float + Float
+
+def cvEstimate(s1, s2, n, known, controls = True):
+    mean = s1/n
+    cov = (s2 - n*numpy.outer(mean, mean))/(n - 1)
+    est, var = mean[0], cov[0, 0]
+    if controls:
+        beta = numpy.linalg.lstsq(cov[1:, 1:], cov[1:, 0], rcond = None)[0]
+        est -= beta.dot(mean[1:] - known)
+        var -= cov[1:, 0].dot(beta)
+    return est, max(var, 0.0)
+
+# --- mcStockPrice ---
+# PURPOSE: Monte Carlo estimate of the expected stock price after T days (kind
+#          = None) or expected log price (kind = 'log'), or of a put/call price
+#          (kind = 'put' or 'call', or any function of the final price, 
+#          discounted at the market rate). The prices are sampled in batches 
+#          with antithetic pairs and, if controls is true, corrected with the 
+#          control variates whose expectations are known: the final price 
+#          itself and the Black-Scholes call at K, except the one that is the 
+#          payoff (or, for a put, a mix of the payoff and the other control). 
+#          Sampling stops once the standard error is at most targetErr or 
+#          maxSamples prices have been drawn, which bounds the time per call.
+#          With sampler = 'sobol' every batch is a separately scrambled set of
+#          Sobol points (see stock_qmc) and the standard error comes from the 
+#          spread of the batch estimates, so at least two batches are drawn
+#          (the batches are made smaller if maxSamples is too small for that).
+# FUNCTION: Stock + Nat + Market + Float + (String or Function) + Float + Nat 
+#           + Nat + Float + Boolean + Boolean + Nat + String -> {String: Any}
+# Note: the result has the keys 'estimate', 'stdErr', 'ci' (the confidence 
+#       interval at the given level), 'samples' and 'converged'
+
+def mcStockPrice(Stk, T, M, K = None, kind = None, targetErr = 0.01, 
+                 batchSize = 10000, maxSamples = 1000000, level = 0.95, 
+                 antithetic = True, controls = True, seed = None, 
+                 sampler = 'random'):
+    rng = numpy.random.default_rng(seed)
+    r = M.getDrift()
+    v = Stk.volatility
+    p = Stk.price
+    tau = T/365.0
+    if K is None: K = p
+    if kind is None: payoff, disc = (lambda s: s), 1.0
+    elif kind == 'log': payoff, disc = numpy.log, 1.0
+    elif kind == 'call': payoff, disc = (lambda s: numpy.maximum(s - K, 0.0)), math.exp(-r*tau)
+    elif kind == 'put': payoff, disc = (lambda s: numpy.maximum(K - s, 0.0)), math.exp(-r*tau)
+    elif callable(kind): payoff, disc = kind, math.exp(-r*tau)
+    else : raise NameError('No such option')
+    if sampler not in ('random', 'sobol'): raise NameError('No such sampler')
+    known = numpy.array([p*math.exp(r*tau), callPrice(p, K, T, r, v)*math.exp(r*tau)])
+    # rows of the samples: the payoff, then the controls used for this kind
+    if kind is None: rows = [0, 2]
+    elif kind in ('call', 'put'): rows = [0, 1]
+    else: rows = [0, 1, 2]
+    known = known[numpy.array(rows[1:]) - 1]
+    signs = (1.0, -1.0) if antithetic else (1.0,)
+    if min(batchSize, maxSamples//len(signs)) < 2: raise NameError('Too few samples')
+    if sampler == 'sobol':
+        # the batches are the replicates, so two of them must fit
+        batchSize = min(batchSize, maxSamples//len(signs)//2)
+        if batchSize < 2: raise NameError('Too few samples for two batches')
+    n, s1, s2 = 0, numpy.zeros(3), numpy.zeros((3, 3))
+    est, var, batches = 0.0, 0.0, []
+    while n*len(signs) < maxSamples:
+        m = min(batchSize, (maxSamples - n*len(signs))//len(signs))
+        if m < 2: break
+        if sampler == 'sobol':
+            from stock_qmc import sobolPoints
+            z = invPhi(sobolPoints(m, 1, rng.integers(2**63))[:, 0])
+        else: z = rng.standard_normal(m)
+        X = numpy.zeros((3, m))
+        for sign in signs:
+            sT = p*numpy.exp((r - v**2/2)*tau + sign*v*math.sqrt(tau)*z)
+            X += [payoff(sT), sT, numpy.maximum(sT - K, 0.0)]
+        X /= len(signs)
+        n += m
+        s1 += X.sum(axis = 1)
+        s2 += X.dot(X.T)
+        if sampler == 'sobol':
+            X = X[rows]
+            batches.append(cvEstimate(X.sum(axis = 1), X.dot(X.T), m, known, controls)[0])
+            if len(batches) < 2: continue
+            est, var = numpy.mean(batches), numpy.var(batches, ddof = 1)*n/len(batches)
+        elif n < 2: continue
+        else: est, var = cvEstimate(s1[rows], s2[numpy.ix_(rows, rows)], n, known, controls)
+        if disc*math.sqrt(var/n) <= targetErr: break
+    est, stdErr = disc*float(est), disc*math.sqrt(var/max(n, 1))
+    half = statistics.NormalDist().inv_cdf(0.5 + level/2.0)*stdErr
+    return {'estimate': est, 'stdErr': stdErr, 'samples': n*len(signs),
+            'ci': (est - half, est + half), 'converged': stdErr <= targetErr}
     
 # --- putPrice ---
-# PURPOSE: uses Black-Scholes to generate a put price
+# PURPOSE: uses Black-Scholes to generate a put price; every argument may also
+#          be an array (or a broadcastable mix of arrays and numbers), in which
+#          case an array of prices is returned. At maturity the put is worth 
+#          its intrinsic value.
 # FUNCTION: Float + Float + Float + Float +  Float + Float -> Float
 # Note: S = current stock price
 #       K = strike price
@@ -58,12 +261,20 @@ def stockPrice(Stk, T, M):
 #       t = current time (in days)
 
 def putPrice(S, K, T, r, v, t = 0.0):
-    d1 = (math.log(S/K) + (r + (v**2.0)/2.0)*((T-t)/365.0)) / v*math.sqrt((T-t)/365.0)
-    d2 = d1 - v*math.sqrt((T-t)/365.0)
-    return max(0,-S*phi(-d1) + K*math.exp(-r*(T - t)/365.0)*phi(-d2)) #Avoid negative valued options
+    terms = scalarTerms(S, K, T, r, v, t)
+    if terms is not None:
+        tau, d1, d2, disc = terms
+        return max(0.0, -S*phi(-d1) + K*disc*phi(-d2))
+    S, K = numpy.asarray(S, dtype = float), numpy.asarray(K, dtype = float)
+    tau, d1, d2, disc = bsTerms(S, K, T, r, v, t)
+    with numpy.errstate(invalid = 'ignore'):
+        price = -S*phi(-d1) + K*disc*phi(-d2)
+    price = numpy.where(tau > 0, price, K - S)
+    return numpy.maximum(0, price)[()] #Avoid negative valued options
 
 # --- callPrice ---
-# PURPOSE: uses Black-Scholes to generate a call price; uses Call-Put parity
+# PURPOSE: uses Black-Scholes to generate a call price; accepts arrays in the 
+#          same way as putPrice
 # FUNCTION: Float + Float + Float + Float + Float + Float -> Float
 # Note: S = current stock price
 #       K = strike price
@@ -73,12 +284,131 @@ def putPrice(S, K, T, r, v, t = 0.0):
 #       t = current time (in days)
 
 def callPrice(S, K, T, r, v, t = 0.0):
-    p = putPrice(S, K, T, r, v, t = 0.0)
-    return max(0,-K*math.exp(-r*(T-t)/365)+S+p) #Avoid negative valued options
+    terms = scalarTerms(S, K, T, r, v, t)
+    if terms is not None:
+        tau, d1, d2, disc = terms
+        return max(0.0, S*phi(d1) - K*disc*phi(d2))
+    S, K = numpy.asarray(S, dtype = float), numpy.asarray(K, dtype = float)
+    tau, d1, d2, disc = bsTerms(S, K, T, r, v, t)
+    with numpy.errstate(invalid = 'ignore'):
+        price = S*phi(d1) - K*disc*phi(d2)
+    price = numpy.where(tau > 0, price, S - K)
+    return numpy.maximum(0, price)[()] #Avoid negative valued options
+        
+# --- optionPrices ---
+# PURPOSE: uses Black-Scholes to generate both the put and the call price from
+#          one evaluation of d1 and d2; accepts arrays in the same way as putPrice
+# FUNCTION: Float + Float + Float + Float + Float + Float -> Float + Float
+
+def optionPrices(S, K, T, r, v, t = 0.0):
+    terms = scalarTerms(S, K, T, r, v, t)
+    if terms is not None:
+        tau, d1, d2, disc = terms
+        call = S*phi(d1) - K*disc*phi(d2)
+        return max(0.0, call - S + K*disc), max(0.0, call)
+    S, K = numpy.asarray(S, dtype = float), numpy.asarray(K, dtype = float)
+    tau, d1, d2, disc = bsTerms(S, K, T, r, v, t)
+    with numpy.errstate(invalid = 'ignore'):
+        call = S*phi(d1) - K*disc*phi(d2)
+        put = call - S + K*disc #Call-Put parity
+    put = numpy.maximum(0, numpy.where(tau > 0, put, K - S))[()]
+    call = numpy.maximum(0, numpy.where(tau > 0, call, S - K))[()]
+    return put, call
+
+# --- optionGreeks ---
+# PURPOSE: uses Black-Scholes to generate the price and the greeks of both the
+#          put and the call in one pass; d1, d2 and the normal terms are only
+#          computed once and, like putPrice, every argument may be an array.
+#          Vega and rho are per unit of volatility and rate, theta is per day.
+# FUNCTION: Float + Float + Float + Float + Float + Float 
+#           -> {String: {String: Float}}
+# Note: the result is {'put': greeks, 'call': greeks} where greeks has the keys
+#       'price', 'delta', 'gamma', 'vega', 'theta' and 'rho'
+
+def optionGreeks(S, K, T, r, v, t = 0.0):
+    S, K = numpy.asarray(S, dtype = float), numpy.asarray(K, dtype = float)
+    tau, d1, d2, disc = bsTerms(S, K, T, r, v, t)
+    live = tau > 0
+    sqrtT = numpy.sqrt(tau)
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        Nd1, Nd2, pdf = phi(d1), phi(d2), dphi(d1)
+        Kdisc = K*disc
+        callPx = S*Nd1 - Kdisc*Nd2
+        putPx = callPx - S + Kdisc #Call-Put parity
+        gamma = pdf/(S*v*sqrtT)
+        vega = S*pdf*sqrtT
+        decay = -S*pdf*v/(2.0*sqrtT)
+        callTheta = (decay - r*Kdisc*Nd2)/365.0
+        putTheta = (decay + r*Kdisc*(1.0 - Nd2))/365.0
+        callRho = Kdisc*tau*Nd2
+        putRho = -Kdisc*tau*(1.0 - Nd2)
+    fix = lambda x, atExpiry = 0.0: numpy.where(live, x, atExpiry)[()]
+    itm = numpy.where(S > K, 1.0, 0.0)
+    greeks = {'gamma': fix(gamma), 'vega': fix(vega)}
+    put = dict(greeks, price = numpy.maximum(0, fix(putPx, K - S))[()],
+               delta = fix(Nd1 - 1.0, itm - 1.0), theta = fix(putTheta),
+               rho = fix(putRho))
+    call = dict(greeks, price = numpy.maximum(0, fix(callPx, S - K))[()],
+                delta = fix(Nd1, itm), theta = fix(callTheta), 
+                rho = fix(callRho))
+    return {'put': put, 'call': call}
         
+# --- impliedVol ---
+# PURPOSE: finds the volatility at which putPrice/callPrice give the observed
+#          option prices, for a whole chain at once. Each contract runs a Newton
+#          iteration on the vega, kept inside a bracket [lo, hi] that shrinks 
+#          every step; a step that leaves the bracket (or a tiny vega) falls 
+#          back to bisection. Only the contracts that have not converged are
+#          repriced. Returns the volatilities and a convergence flag for each
+#          contract. Prices outside the bracket never converge, and neither do
+#          prices that hardly move with the volatility (at most tol/volTol per
+#          unit, e.g. worthless or deep in the money options priced at their
+#          bound), since the price does not pin their volatility down.
+# FUNCTION: Float + Float + Float + Float + Float + Float + String + Float + Nat
+#           + Float + Float + Float -> [Arrayof Float] + [Arrayof Boolean]
+# Note: kind is 'call', 'put', or an array of them; tol is on the price and 
+#       volTol on the volatility
+
+def impliedVol(price, S, K, T, r, t = 0.0, kind = 'call', tol = 1e-8, 
+               maxIter = 100, lo = 1e-4, hi = 5.0, volTol = 1e-4):
+    price, S, K, T, r, t, isCall = numpy.broadcast_arrays(
+        *[numpy.asarray(a, dtype = float) for a in (price, S, K, T, r, t)] + 
+        [numpy.asarray(kind) == 'call'])
+    shape = price.shape
+    price, S, K, T, r, t, isCall = [a.ravel() for a in (price, S, K, T, r, t, isCall)]
+    tau = numpy.maximum(T - t, 0.0)/365.0
+    lo, hi = numpy.full(len(price), float(lo)), numpy.full(len(price), float(hi))
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        sigma = numpy.sqrt(2.0*numpy.abs(numpy.log(S/K) + r*tau)/tau) #Manaster-Koehler
+    sigma = numpy.where(numpy.isfinite(sigma), numpy.clip(sigma, lo, hi), 0.5*(lo + hi))
+    sigma[tau <= 0] = numpy.nan
+    converged = numpy.zeros(len(price), dtype = bool)
+    active = numpy.flatnonzero(tau > 0)
+    for i in range(maxIter):
+        if len(active) == 0: break
+        a = active
+        x = numpy.where(isCall[a], 1.0, -1.0)
+        d1 = bsTerms(S[a], K[a], T[a], r[a], sigma[a], t[a])[1]
+        disc = numpy.exp(-r[a]*tau[a])
+        d2 = d1 - sigma[a]*numpy.sqrt(tau[a])
+        model = x*(S[a]*phi(x*d1) - K[a]*disc*phi(x*d2))
+        vega = S[a]*dphi(d1)*numpy.sqrt(tau[a])
+        diff = model - price[a]
+        done = numpy.abs(diff) <= tol
+        converged[a[done]] = vega[done]*volTol >= tol
+        hi[a] = numpy.where(diff > 0, sigma[a], hi[a])
+        lo[a] = numpy.where(diff < 0, sigma[a], lo[a])
+        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            step = sigma[a] - diff/vega
+        bad = ~((step > lo[a]) & (step < hi[a]))
+        step[bad] = 0.5*(lo[a][bad] + hi[a][bad])
+        sigma[a] = numpy.where(done, sigma[a], step)
+        active = a[~done & (hi[a] - lo[a] > 1e-15)]
+    return sigma.reshape(shape)[()], converged.reshape(shape)[()]
+
 # CLASSES ----------------------------------------------------------------------
 
-import math, pylab, random
+import collections, itertools, math, random # pylab is only imported when something is plotted
 
 # Here, we define a couple classes:
 
@@ -90,18 +420,48 @@ import math, pylab, random
 
 # --- Stock ---
 # DESCRIPTION: describes the status of a stock that is randomly increasing or 
-#              decreasing over time
-# FIELDS: Nat(price), Function(distribution), [Listof Nat](history), Nat(lastChange)
+#              decreasing over time; the history is kept in an array that is 
+#              preallocated from the duration (when it is known) and grows when
+#              it is full. With keepHistory = False only a running summary of the 
+#              path is kept (see summary), so large ensembles fit in memory.
+# FIELDS: Nat(price), Function(distribution), [Arrayof Nat](history), Nat(lastChange),
+#         Nat(duration), Type(dtype)
 
 class Stock(object):
-    def __init__(self, price, distribution):
+    __slots__ = ('price', 'distribution', 'lastChange', 'duration', '_history',
+                 '_size', '_min', '_max', '_sum')
+    def __init__(self, price, distribution, duration = None, 
+                 dtype = numpy.float64, keepHistory = True):
         self.price = price
-        self.history = [price]
         self.distribution = distribution
         self.lastChange = 0
+        self.duration = duration
+        self._history = None
+        if keepHistory:
+            self._history = numpy.empty((duration or 0) + 1, dtype = dtype)
+        self._size = 0
+        self._min = self._max = price
+        self._sum = 0.0
+        self._record(price)
+    def _record(self, price):
+        if self._history is not None:
+            if self._size == len(self._history):
+                self._history = numpy.resize(self._history, 2*self._size)
+            self._history[self._size] = price
+        self._size += 1
+        self._min = min(self._min, price)
+        self._max = max(self._max, price)
+        self._sum += price
+    @property
+    def history(self):
+        if self._history is None: return None
+        return self._history[:self._size]
+    def summary(self):
+        return {'min': self._min, 'max': self._max, 'mean': self._sum/self._size,
+                'last': self.price, 'count': self._size}
     def setPrice(self, price):
         self.price = price
-        self.history.append(price)
+        self._record(price)
     def getPrice(self):
         return self.price
     def makeMove(self, mktBias, mo):
@@ -112,9 +472,10 @@ class Stock(object):
             self.price = self.price + random.gauss(0.5,0.5) * self.lastChange
         if self.price < 0.01:
             self.price = 0.0
-        self.history.append(self.price)
+        self._record(self.price)
         self.lastChange = oldPrice - self.price
     def showHistory(self, figNum):
+        import pylab
         pylab.figure(figNum)
         plot = pylab.plot(self.history, label = 'Test Stock')
         plot
@@ -132,13 +493,12 @@ class Stock(object):
 #          volatility value}
 
 class NewStock(Stock):
-    def __init__(self, name, price, volatility, time):
+    __slots__ = ('name', 'volatility')
+    def __init__(self, name, price, volatility, time, 
+                 dtype = numpy.float64, keepHistory = True):
+        Stock.__init__(self, price, None, time, dtype, keepHistory)
         self.name = name
-        self.price = price
-        self.history = [price]
         self.volatility = volatility
-        self.lastChange = 0
-        self.duration = time
     def makeMove(self, drift, mo):
         oldPrice = self.price
         vol = self.volatility
@@ -151,63 +511,274 @@ class NewStock(Stock):
             self.price = self.price + random.gauss(0.5,0.5) * self.lastChange
         if self.price < 0.01:
             self.price = 0.0
-        self.history.append(self.price)
+        self._record(self.price)
         self.lastChange = oldPrice - self.price
     
 # --- Market ---
 # DESCRIPTION: describes the market in which the stock is running in; essentially
-#              describing the environment in which the simulator is runnning in
-# FIELDS: Float(drift), [Listof Tuples](trends)
+#              describing the environment in which the simulator is runnning in.
+#              The trends are compiled once into a calendar holding the bf shock
+#              factor of every day (a trend hits the price lead days before its
+#              date): one table for the trends that repeat every year and a 
+#              sorted index of the one-off ones, so looking up a day or a range
+#              of days does not scan the trends and does not grow with time.
+# FIELDS: Float(drift), [Listof Trend](trends), Nat(yearLength), Nat(lead)
 
 class Market(object):
-    def __init__(self, drift, trends):
+    def __init__(self, drift, trends, yearLength = 365, lead = 7):
         self.drift = drift
         self.trends = trends
+        self.yearLength = yearLength
+        self.lead = lead
+        self.yearly = None
     def getDrift(self):
         return self.drift
     def getTrends(self):
         return self.trends
+    def trendDays(self, trend, numDays, lead = 0):
+        day = trend.day - lead
+        if trend.year is not None:
+            day += trend.year*self.yearLength
+            if not 0 <= day < numDays: return numpy.arange(0)
+            return numpy.arange(day, day+1)
+        if not 0 <= day < self.yearLength: return numpy.arange(0)
+        return numpy.arange(day, numDays, self.yearLength)
+    def compileCalendar(self):
+        self.yearly = numpy.ones(self.yearLength)
+        self.oneOff = {}
+        for trend in self.trends:
+            day = trend.day - self.lead
+            if trend.year is None:
+                if 0 <= day < self.yearLength: self.yearly[day] *= 1 + trend.factor
+            elif day + trend.year*self.yearLength >= 0:
+                day += trend.year*self.yearLength
+                self.oneOff[day] = self.oneOff.get(day, 1.0)*(1 + trend.factor)
+        self.oneOffDays = numpy.array(sorted(self.oneOff), dtype = int)
+        self.oneOffFactors = numpy.array([self.oneOff[d] for d in self.oneOffDays])
+    def getCalendar(self, numDays, start = 0):
+        if self.yearly is None: self.compileCalendar()
+        factors = self.yearly[numpy.arange(start, start+numDays) % self.yearLength]
+        first, last = numpy.searchsorted(self.oneOffDays, [start, start+numDays])
+        factors[self.oneOffDays[first:last] - start] *= self.oneOffFactors[first:last]
+        return factors
+    def getShock(self, day):
+        if self.yearly is None: self.compileCalendar()
+        return self.yearly[day % self.yearLength]*self.oneOff.get(day, 1.0)
+    def getEvents(self, numDays):
+        events = [(d, trend) for trend in self.trends 
+                  for d in self.trendDays(trend, numDays)]
+        return sorted(events, key = lambda event: event[0])
 
 # --- Derivative ---
-# DESCRIPTION: describes the characteristics of a derivative
-# FIELDS: Float(S), Float(K), Float(T), Float(r), Float(v)
+# DESCRIPTION: describes the characteristics of a derivative; the style says 
+#              how its payoff depends on the path of the stock:
+#              'european' = the intrinsic value at maturity
+#              'asian'    = the intrinsic value of the average daily price
+#              'lookback' = the intrinsic value of the best price (fixed strike)
+#              'american' = may be exercised on any day (priced by priceBook)
+#              and if a barrier is given (not for 'american'), the option only
+#              pays if the stock touches it (knockIn) or never touches it 
+#              (otherwise); the barrier is an up barrier if it is above S and a
+#              down barrier if below.
+#              European options get their price from Black-Scholes, the others
+#              from stock_simulator.priceBook (run with its defaults when the 
+#              price is first asked for; call priceBook for a seed or more 
+#              paths). Prices are on a daily grid: the option matures after 
+#              daysLeft() whole days, in the closed form as on the paths. Only
+#              PutOption and CallOption can be made; a subclass gives the
+#              intrinsic(prices) value of the option for an array of prices and
+#              the extreme ('max' or 'min') price that a lookback pays on.
+# FIELDS: Float(S), Float(K), Float(T), Float(r), Float(v), Float(t), 
+#         String(style), Float(barrier), Boolean(knockIn), Float(price), 
+#         Float(stdErr)
 # Note: S = current stock price
 #       K = strike price
 #       T = maturity time (in days)
 #       r = risk-free interest rate
 #       v = volatility
+#       t = current time (in days)
 
 class Derivative(object):
-    def __init__(self, S, K, T, r, v, t):
+    styles = ('european', 'asian', 'lookback', 'american')
+    def __init__(self, S, K, T, r, v, t = 0.0, style = 'european', barrier = None,
+                 knockIn = False):
+        if type(self) is Derivative: raise NameError('Use PutOption or CallOption')
+        if style not in self.styles: raise NameError('No such style')
+        if style == 'american' and barrier is not None: 
+            raise NameError('No barrier on American options')
         self.stockPrice = S
         self.strikePrice = K
         self.maturity = T
         self.rfrate = r
         self.volatility = v
         self.curTime = t
-    def setPrice(self):
-        self.price = K
+        self.style = style
+        self.barrier = barrier
+        self.knockIn = knockIn
+        self.price = None
+        self.stdErr = None
+    def setPrice(self, price = None):
+        if price is None: price = self.closedForm()
+        if price is None:
+            from stock_simulator import priceBook
+            price = priceBook([self])[0]
+        self.price = price
     def getPrice(self):
-        return self.price()
+        if self.price is None: self.setPrice()
+        return self.price
+    def daysLeft(self):
+        return int(round(self.maturity - self.curTime))
+    def expiry(self):
+        return self.curTime + self.daysLeft()
+    def closedForm(self):
+        return None
+    def payoff(self, paths, memo = None):
+        # paths start today (column 0) and have one column per day; memo holds
+        # the path statistics shared by the instruments of a book
+        if memo is None: memo = {}
+        n = self.daysLeft()
+        if self.style == 'asian': pay = self.intrinsic(pathStat(paths, 'mean', n, memo))
+        elif self.style == 'lookback': pay = self.intrinsic(pathStat(paths, self.extreme, n, memo))
+        else: pay = self.intrinsic(numpy.asarray(paths[:, n], dtype = float))
+        if self.barrier is not None:
+            if self.barrier > self.stockPrice: hit = pathStat(paths, 'max', n, memo) >= self.barrier
+            else: hit = pathStat(paths, 'min', n, memo) <= self.barrier
+            pay = pay*(hit if self.knockIn else ~hit)
+        return pay
+
+# --- pathStat ---
+# PURPOSE: the running 'max', 'min' or 'mean' (of days 1 to n) of every path up
+#          to day n, remembered in memo so that it is only computed once per book
+# FUNCTION: [Arrayof Float] + String + Nat + Dict -> [Arrayof Float]
+
+def pathStat(paths, name, n, memo):
+    if (name, n) not in memo:
+        window = numpy.asarray(paths[:, :n+1], dtype = float)
+        if name == 'max': memo[(name, n)] = window.max(axis = 1)
+        elif name == 'min': memo[(name, n)] = window.min(axis = 1)
+        elif name == 'mean': memo[(name, n)] = window[:, 1:].mean(axis = 1) if n else window[:, 0]
+        else : raise NameError('No such statistic')
+    return memo[(name, n)]
     
+# --- Trend ---
+# DESCRIPTION: describes a market event on a given day of the year; it repeats
+#              every year unless a year (counting from 0) is given
+# FIELDS: String(name), Nat(day), Float(factor), Nat(year)
+
 class Trend(object):
-    def __init__(self, name, day, factor):
+    def __init__(self, name, day, factor, year = None):
         self.name = name
         self.day = day
         self.factor = factor
+        self.year = year
         
-# ------------ WIP : Need more features ----------------------------------------
+# --- PricingCache ---
+# DESCRIPTION: an opt-in memo of Black-Scholes prices; the inputs are rounded to
+#              decimals places (one number for all of them, or one per input in
+#              the order S, K, T, r, v, t) and the put and call for a key are 
+#              computed together and kept in a least recently used table of at
+#              most maxSize entries. A scalar contract is looked up directly; 
+#              the contracts of an array are rounded and deduplicated in numpy
+#              first, so every distinct key is looked up (and counted) once per
+#              call and all of the misses are priced in one call.
+# FIELDS: Nat(maxSize), Nat(decimals), [Listof Float](scales), 
+#         OrderedDict(entries), Nat(hits), Nat(misses), Nat(evictions)
+
+class PricingCache(object):
+    def __init__(self, maxSize = 100000, decimals = 6):
+        self.maxSize = maxSize
+        self.decimals = decimals
+        if numpy.ndim(decimals) == 0: decimals = [decimals]*6
+        self.scales = [10.0**d for d in decimals]
+        self.entries = collections.OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+    def quantize(self, S, K, T, r, v, t):
+        # numpy.round(x, d) is rint(x*10**d)/10**d, which the scalar keys repeat
+        return [numpy.rint(numpy.asarray(a, dtype = float)*p)/p 
+                for a, p in zip(numpy.broadcast_arrays(S, K, T, r, v, t), self.scales)]
+    def evict(self):
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last = False)
+            self.evictions += 1
+    def prices(self, S, K, T, r, v, t = 0.0):
+        if isinstance(S, scalars) and isinstance(K, scalars) and isinstance(T, scalars) \
+           and isinstance(r, scalars) and isinstance(v, scalars) and isinstance(t, scalars):
+            pS, pK, pT, pr, pv, pt = self.scales
+            key = (round(S*pS)/pS, round(K*pK)/pK, round(T*pT)/pT, 
+                   round(r*pr)/pr, round(v*pv)/pv, round(t*pt)/pt)
+            hit = self.entries.get(key)
+            if hit is None:
+                self.misses += 1
+                hit = self.entries[key] = optionPrices(*key)
+                self.evict()
+                return hit
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return hit
+        inputs = [a.ravel() for a in self.quantize(S, K, T, r, v, t)]
+        shape = numpy.broadcast(S, K, T, r, v, t).shape
+        if not inputs[0].size: return numpy.zeros(shape), numpy.zeros(shape)
+        # sort the contracts and keep the first of every run of equal ones
+        fixed = [not (a != a[0]).any() for a in inputs]
+        varying = [a for a, same in zip(inputs, fixed) if not same]
+        order = numpy.lexsort(varying) if varying else numpy.arange(inputs[0].size)
+        new = numpy.zeros(order.size, bool)
+        new[0] = True
+        for a in varying: new[1:] |= a[order][1:] != a[order][:-1]
+        inverse = numpy.empty(order.size, int)
+        inverse[order] = numpy.cumsum(new) - 1
+        first = order[new]
+        # an input that is the same for every contract is not copied into lists
+        keys = list(zip(*[itertools.repeat(a[0].item(), len(first)) if same else a[first].tolist()
+                          for a, same in zip(inputs, fixed)]))
+        found = list(map(self.entries.get, keys))
+        missing = [i for i, hit in enumerate(found) if hit is None]
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        for key, hit in zip(keys, found):
+            if hit is not None: self.entries.move_to_end(key)
+        if missing:
+            put, call = optionPrices(*[numpy.array([keys[i][j] for i in missing]) 
+                                       for j in range(6)])
+            for i, p, c in zip(missing, put.tolist(), call.tolist()):
+                found[i] = self.entries[keys[i]] = (p, c)
+            self.evict()
+        found = numpy.array(found).reshape(-1, 2)[inverse]
+        return found[:, 0].reshape(shape)[()], found[:, 1].reshape(shape)[()]
+    def putPrice(self, S, K, T, r, v, t = 0.0):
+        return self.prices(S, K, T, r, v, t)[0]
+    def callPrice(self, S, K, T, r, v, t = 0.0):
+        return self.prices(S, K, T, r, v, t)[1]
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self.entries), 'hitRate': self.hits/float(total or 1)}
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
 
 # ---PutOption ---
 # DESCRIPTION: describes the characteristics of a put option
-# FIELDS: Float(S), Float(K), Float(T), Float(r), Float(v), Float(t)
+# FIELDS: {Inherited from the Derivative class}
 
 class PutOption(Derivative):
-    pass
+    extreme = 'min'
+    def intrinsic(self, prices):
+        return numpy.maximum(self.strikePrice - prices, 0.0)
+    def closedForm(self):
+        if self.style != 'european' or self.barrier is not None: return None
+        return putPrice(self.stockPrice, self.strikePrice, self.expiry(), 
+                        self.rfrate, self.volatility, self.curTime)
         
 # ---CallOption ---
 # DESCRIPTION: describes the characteristics of a call option
-# FIELDS: Float(S), Float(K), Float(T), Float(r), Float(v), Float(t)
+# FIELDS: {Inherited from the Derivative class}
 
 class CallOption(Derivative):
-    pass 
\ No newline at end of file
+    extreme = 'max'
+    def intrinsic(self, prices):
+        return numpy.maximum(prices - self.strikePrice, 0.0)
+    def closedForm(self):
+        if self.style != 'european' or self.barrier is not None: return None
+        return callPrice(self.stockPrice, self.strikePrice, self.expiry(), 
+                         self.rfrate, self.volatility, self.curTime)
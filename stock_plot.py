@@ -9,7 +9,7 @@
 # that the efficient market hypothesis holds true; this simulation will be a 
 # modified version of a random walk
 
-import math, pylab, random
+import math, numpy, random # pylab is only imported when something is plotted
 from stock_classes import *
 from stock_simulator import *
 
@@ -20,6 +20,7 @@ from stock_simulator import *
 # FUNCTION: Float + [Listof Float] + Market + Figure + Float -> (Void)
 
 def bfAnnotate2(xRange, yVals, M, fig, scale):
+    import pylab
     for d in range(xRange):                 #only if BF is true
         for date in M.getTrends():
             # Annotations
@@ -37,26 +38,117 @@ def bfAnnotate2(xRange, yVals, M, fig, scale):
                 counter %= 2
 
 # --- bfAnnotate2 ---
-# PURPOSE: Annotates a stock sim if bf = True (ver. 2)
-# FUNCTION: Float + [Listof Float] + Market + Figure + Float -> (Void)
+# PURPOSE: Annotates a stock sim if bf = True (ver. 2); fig is the axes that
+#          the stock was plotted on
+# FUNCTION: Float + [Listof Float] + Market + Axes + Float -> (Void)
 
 def bfAnnotate(xRange, yVals, M, fig, scale):
     counter = 1                             #used for annotating
-    for d in range(xRange):                 #only if BF is true
-        for date in M.getTrends():
-            # Annotations
-            if (date.day == d % 365 and counter == 1):
-                pylab.annotate(date.name, xy=(d, yVals[d]), textcoords = 'offset points',
-                               xytext = (0,scale*yVals[d]), ha ='center', 
-                               arrowprops=dict(arrowstyle="->", connectionstyle="arc"))
-                counter += 1
-                counter %= 2
-            elif (date.day == d % 365 and counter == 0):
-                pylab.annotate(date.name, xy=(d, yVals[d]), textcoords = 'offset points',
-                               xytext = (0,-scale*yVals[d]), ha ='center', 
-                               arrowprops=dict(arrowstyle="->", connectionstyle="arc"))
-                counter += 1
-                counter %= 2
+    for d, date in M.getEvents(xRange):     #only if BF is true
+        # Annotations
+        sign = 1 if counter == 1 else -1
+        fig.annotate(date.name, xy=(d, yVals[d]), textcoords = 'offset points',
+                     xytext = (0,sign*scale*yVals[d]), ha ='center', 
+                     arrowprops=dict(arrowstyle="->", connectionstyle="arc"))
+        counter += 1
+        counter %= 2
+
+# --- decimate ---
+# PURPOSE: shrinks a path (or a matrix of paths, one per row) to at most 
+#          maxPoints points (at least 4) by keeping the first and last day and
+#          the lowest and highest price of every bucket of days in between, in
+#          the order they happened, so the start, the close, the peaks, the 
+#          troughs and the overall shape of a long history survive; returns the
+#          days kept and the prices (both with the shape of the paths, minus the
+#          dropped days)
+# FUNCTION: [Arrayof Float] + Nat -> [Arrayof Nat] + [Arrayof Float]
+
+def decimate(paths, maxPoints = 2000):
+    paths = numpy.asarray(paths)
+    numDays = paths.shape[-1]
+    if maxPoints is None or numDays <= maxPoints: 
+        return numpy.broadcast_to(numpy.arange(numDays), paths.shape), paths
+    inner = numDays - 2
+    width = int(math.ceil(inner/float(max(maxPoints - 2, 2)//2)))
+    numBuckets = int(math.ceil(inner/float(width)))
+    # the last bucket is padded with its last day, so it may be shorter
+    pad = [(0, 0)]*(paths.ndim - 1) + [(0, numBuckets*width - inner)]
+    body = numpy.pad(paths[..., 1:-1], pad, mode = 'edge')
+    body = body.reshape(paths.shape[:-1] + (numBuckets, width))
+    lo, hi = body.argmin(axis = -1), body.argmax(axis = -1)
+    start = 1 + numpy.arange(numBuckets)*width
+    days = numpy.stack((start + numpy.minimum(lo, hi), start + numpy.maximum(lo, hi)), 
+                       axis = -1)
+    days = numpy.minimum(days, numDays - 2).reshape(paths.shape[:-1] + (2*numBuckets,))
+    ends = numpy.broadcast_to([0], paths.shape[:-1] + (1,))
+    days = numpy.concatenate((ends, days, ends + numDays - 1), axis = -1)
+    return days, numpy.take_along_axis(paths, days, axis = -1)
+
+# --- drawEnsemble ---
+# PURPOSE: draws many paths (one per row) on ax without one artist per path: 
+#          'collection' draws the decimated paths as a single LineCollection,
+#          'fan' draws the median and the bands between the given percentiles 
+#          of every day, and 'density' draws a heat map of how many paths are
+#          at each price on each day (bins price bins); 'lines' is the old one
+#          plot per path. Very large collections are rasterized.
+# FUNCTION: Axes + [Arrayof Float] + String + Nat + [Listof Float] + Nat -> (Void)
+
+def drawEnsemble(ax, paths, mode = 'collection', maxPoints = 1000, 
+                 levels = (5, 25, 75, 95), bins = 200):
+    paths = numpy.asarray(paths)
+    if mode == 'lines':
+        for history in paths: ax.plot(history)
+    elif mode == 'collection':
+        import matplotlib
+        from matplotlib.collections import LineCollection
+        days, prices = decimate(paths, maxPoints)
+        colors = matplotlib.rcParams['axes.prop_cycle'].by_key()['color']
+        lines = LineCollection(numpy.stack((days, prices), axis = -1), 
+                               colors = colors, linewidths = 0.8,
+                               alpha = min(1.0, max(0.05, 20.0/len(paths))))
+        # millions of vertices are drawn as an image even in SVG/PDF files
+        lines.set_rasterized(prices.size > 1000000)
+        ax.add_collection(lines)
+        ax.autoscale_view()
+    elif mode == 'fan':
+        levels = sorted(levels)
+        bands = numpy.percentile(paths, levels + [50], axis = 0)
+        days = numpy.arange(paths.shape[1])
+        for i in range(len(levels)//2):
+            ax.fill_between(days, bands[i], bands[len(levels)-1-i], color = 'C0', 
+                            alpha = 0.2 + 0.2*i, linewidth = 0,
+                            label = '%g-%g%%' % (levels[i], levels[len(levels)-1-i]))
+        ax.plot(days, bands[-1], color = 'C0', label = 'Median')
+    elif mode == 'density':
+        from matplotlib.colors import LogNorm
+        lo, hi = numpy.percentile(paths, (0.5, 99.5))
+        which = numpy.floor((paths - lo)/(hi - lo)*bins).astype(int)
+        inside = (which >= 0) & (which < bins)
+        day = numpy.broadcast_to(numpy.arange(paths.shape[1]), paths.shape)
+        counts = numpy.bincount(day[inside]*bins + which[inside], 
+                                minlength = paths.shape[1]*bins)
+        counts = counts.reshape(paths.shape[1], bins).T.astype(float)
+        counts[counts == 0] = numpy.nan
+        image = ax.imshow(counts, origin = 'lower', aspect = 'auto', cmap = 'viridis',
+                          extent = (0, paths.shape[1] - 1, lo, hi), norm = LogNorm(),
+                          interpolation = 'nearest')
+        ax.figure.colorbar(image, ax = ax, label = 'Paths')
+    else: raise NameError('No such mode')
+
+# --- saveFigure ---
+# PURPOSE: draws a figure with draw (a function of the figure, e.g. lambda fig:
+#          plotMulti(..., fig)) on a figure that is never shown and writes it to
+#          fileName (PNG, SVG, PDF, ... by its extension), so plots can be made 
+#          in batch jobs without a display
+# FUNCTION: String + Function + (Float + Float) + Nat -> (Void)
+
+def saveFigure(fileName, draw, size = (16, 9), dpi = 100):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize = size, dpi = dpi)
+    FigureCanvasAgg(fig)
+    draw(fig)
+    fig.savefig(fileName)
 
 # GLOBAL VARIABLES -------------------------------------------------------------
 
@@ -65,11 +157,7 @@ v = volatility = 0.3 #To reduce typing
 ctsMarketRate = rfrate = 0.04
 
 # List of all trends as a [Listof Trend]
-Trends = [Trend('Christmas', mdToNum(12,25), 0.05*v),
-          Trend('Valentines Day', mdToNum(2,14), 0.005*v), 
-          Trend('March Break', mdToNum(3,10), 0.001*v), 
-          Trend('September $1^{st}$', mdToNum(9,1), -0.001*v), #; usually the lowest performing month
-          Trend('Black Monday', mdToNum(10,19), -0.005*v)]
+Trends = defaultTrends(v)
 
 # VERY important variables for the stock simulations
 market = Market(rfrate, Trends)
@@ -94,18 +182,21 @@ strike = startPrice*math.exp(maturity/365.0*rfrate)
 #       v = volatility
 
 # --- plotStock ---
-# PURPOSE: plots a stock simulation using runStockSim
-# FUNCTION: String + Float + Nat + Float + Market + Boolean + Boolean + Figure -> (Void)
+# PURPOSE: plots a stock simulation using runStockSim, or a path that was
+#          already simulated (e.g. a row of a path store) if history is given;
+#          paths longer than maxPoints days are decimated
+# FUNCTION: String + Float + Nat + Float + Market + Boolean + Boolean + Figure 
+#           + [Arrayof Float] + Nat -> (Void)
 
-def plotStock(name, S, T, v, M, mo, bf, fig):
-    history = runStockSim(name, S, T, v, M, mo, bf)
+def plotStock(name, S, T, v, M, mo, bf, fig, history = None, maxPoints = 4000):
+    if history is None: history = runStockSim(name, S, T, v, M, mo, bf)
     ax = fig.add_subplot(111)
     titleP1 = 'Simulation of Stock ' + str(name) + '\n'
     titleP2 = '$t='+str(T)+'\,(days),\,\sigma='+str(v)+',\,r='+str(M.drift)
     titleP3 = ',\,S_{0}='+str(S)+',\,mo='+str(mo)+',\,bf='+str(bf)+'$'
     plotTitle = titleP1 + titleP2 + titleP3
     ax.set_title(plotTitle)
-    ax.plot(history, label = 'Stock' + str(name))
+    ax.plot(*decimate(history, maxPoints), label = 'Stock' + str(name))
     ax.set_xlabel('Time (days)')
     ax.set_ylabel('Price')
     #ax.grid(True)
@@ -114,45 +205,33 @@ def plotStock(name, S, T, v, M, mo, bf, fig):
 
 # --- plotGreeks ---
 # PURPOSE: uses Black-Scholes to generate a graph of put and call prices in 
-#          relation to some variable; practical way to visualize the greeks
-# FUNCTION: Float + Float + Float + Float + Float + String + Figure -> (Void)
+#          relation to some variable; practical way to visualize the greeks.
+#          Setting greek to 'delta', 'gamma', 'vega', 'theta' or 'rho' plots 
+#          that (analytic) sensitivity instead of the price
+# FUNCTION: Float + Float + Float + Float + Float + String + Figure + String -> (Void)
 # Variables are Market, Strike, Risk-Free-Rate, Volatility, Maturity in Days, Time-Remaining
 
-def plotGreeks(S, K, T, r, v, var, fig):
-    x = pylab.arange(0.9,1.1,0.001)
-    putPrices = []
-    callPrices = []
+def plotGreeks(S, K, T, r, v, var, fig, greek = 'price'):
+    x = numpy.arange(0.9,1.1,0.001)
     if var == 'Market Price': 
-        x = pylab.multiply(x,S)
-        putPrices = x.copy()
-        callPrices = x.copy()
-        for i in range(len(x)): putPrices[i] = putPrice(x[i], K, T, r, v)
-        for i in range(len(x)): callPrices[i] = callPrice(x[i], K, T, r, v)
+        x = numpy.multiply(x,S)
+        args = (x, K, T, r, v)
     elif var == 'Strike Price' : 
-        x = pylab.multiply(x,K)
-        putPrices = x.copy()
-        callPrices = x.copy()
-        for i in range(len(x)): putPrices[i] = putPrice(S, x[i], T, r, v)
-        for i in range(len(x)): callPrices[i] = callPrice(S, x[i], T, r, v)        
+        x = numpy.multiply(x,K)
+        args = (S, x, T, r, v)
     elif var == 'Risk-free-rate' : 
-        x = pylab.multiply(x,r)
-        putPrices = x.copy()
-        callPrices = x.copy()
-        for i in range(len(x)): putPrices[i] = putPrice(S, K, T, x[i], v)
-        for i in range(len(x)): callPrices[i] = callPrice(S, K, T, x[i], v)        
+        x = numpy.multiply(x,r)
+        args = (S, K, T, x, v)
     elif var == 'Volatility' : 
-        x = pylab.multiply(x,v)
-        putPrices = x.copy()
-        callPrices = x.copy()
-        for i in range(len(x)): putPrices[i] = putPrice(S, K, T, r, x[i])
-        for i in range(len(x)): callPrices[i] = callPrice(S, K, T, r, x[i])
+        x = numpy.multiply(x,v)
+        args = (S, K, T, r, x)
     elif var == 'Maturity in Days' : 
-        x = pylab.multiply(x,T)
-        putPrices = x.copy()
-        callPrices = x.copy()
-        for i in range(len(x)): putPrices[i] = putPrice(S, K, x[i], r, v)
-        for i in range(len(x)): callPrices[i] = callPrice(S, K, x[i], r, v)
+        x = numpy.multiply(x,T)
+        args = (S, K, x, r, v)
     else : raise NameError('No such variable')
+    greeks = optionGreeks(*args)
+    putPrices = greeks['put'][greek]
+    callPrices = greeks['call'][greek]
     ax = fig.add_subplot(111)
     titleP1 = 'European Options Simulation \n'
     titleP2 = '$t='+str(T*12/365)+'\,(months),\,\sigma='+str(v)+',\,r='+str(r)
@@ -162,26 +241,29 @@ def plotGreeks(S, K, T, r, v, var, fig):
     ax.plot(x, putPrices, label = 'Put Option')
     ax.plot(x, callPrices, label = 'Call Option')
     ax.set_xlabel(var)
-    ax.set_ylabel('Option Prices')
+    ax.set_ylabel('Option Prices' if greek == 'price' else 'Option ' + greek.title())
     ax.legend(loc=9)
     #ax.grid(True)
     
 # --- plotOptions ---
-# PURPOSE: plots a stock simulation using runStockSim and uses data to plot
-#          an option simulation
-# FUNCTION: String + Float + Float + Nat + Float + Market + Boolean + Boolean + Figure -> (Void)
+# PURPOSE: plots a stock simulation using runStockSim (or the given history,
+#          as in plotStock) and uses data to plot an option simulation; the
+#          put and call prices come from one evaluation, or from a PricingCache
+#          if one is given; series longer than maxPoints days are decimated
+# FUNCTION: String + Float + Float + Nat + Float + Market + Boolean + Boolean + Figure 
+#           + [Arrayof Float] + PricingCache + Nat -> (Void)
 
-def plotOptions(name, S, K, T, v, M, mo, bf, fig):
+def plotOptions(name, S, K, T, v, M, mo, bf, fig, history = None, cache = None,
+                maxPoints = 4000):
     r = market.getDrift()    
-    history = runStockSim(name, S, T, volatility, market, mo, bf)
-    putPrices = history[:]
-    callPrices = history[:]
-    for i in range(len(history)): putPrices[i] = putPrice(history[i], K, T-i, r, v)
-    for i in range(len(history)): callPrices[i] = callPrice(history[i], K, T-i, r, v)
+    if history is None: history = runStockSim(name, S, T, volatility, market, mo, bf)
+    daysLeft = T - numpy.arange(len(history))
+    pricer = optionPrices if cache is None else cache.prices
+    putPrices, callPrices = pricer(numpy.asarray(history), K, daysLeft, r, v)
     # Plot the stock
     ax1 = fig.add_subplot(211) #subplot feature
     ##ax1 = fig.add_subplot(111) #single plot feauture
-    ln1 = ax1.plot(history, label = 'Stock ' + str(name), color='r')
+    ln1 = ax1.plot(*decimate(history, maxPoints), label = 'Stock ' + str(name), color='r')
     titleP1 = 'Simulation of Stock ' + str(name) + ' and European Options\n'
     titleP2 = '$t='+str(T)+'\,(days),\,\sigma='+str(v)+',\,r='+str(M.drift)
     titleP3 = ',\,S_{0}='+str(S)+',\,K='+str(K)+',\,mo='+str(mo)+',\,bf='+str(bf)+'$'
@@ -195,8 +277,8 @@ def plotOptions(name, S, K, T, v, M, mo, bf, fig):
     # Plot the options
     ax2 = fig.add_subplot(212) #subplot feature
     ##ax2 = ax1.twinx() #single plot feature
-    ln2 = ax2.plot(putPrices, label = 'Put Option')
-    ln3 = ax2.plot(callPrices, label = 'Call Option')
+    ln2 = ax2.plot(*decimate(putPrices, maxPoints), label = 'Put Option')
+    ln3 = ax2.plot(*decimate(callPrices, maxPoints), label = 'Call Option')
     ax2.set_xlabel('Time (days)')
     ax2.set_ylabel('Options Price')
     ax2.legend() #subplot feature
@@ -205,21 +287,23 @@ def plotOptions(name, S, K, T, v, M, mo, bf, fig):
     ##ax1.legend(lns, labs, mode='expand', ncol=3) #single plot feature
     
 # --- plotMulti ---
-# PURPOSE: plots a stock simulation of many stocks
-# FUNCTION: Nat + Float + Nat + Float + Market + Boolean + Boolean + Figure -> (Void)
+# PURPOSE: plots a stock simulation of many stocks; the stocks are simulated 
+#          with runEnsemble, so a seed reproduces the plot for any numWorkers.
+#          mode picks how the paths are drawn (see drawEnsemble); 'lines' (one
+#          line per stock) is only practical for a few dozen stocks
+# FUNCTION: Nat + Float + Nat + Float + Market + Boolean + Boolean + Figure 
+#           + Nat + Nat + String + Nat -> (Void)
 
-def plotMulti(numStks, S, T, v, M, mo, bf, fig):
-    mean = 0
-    avgVol = 0
+def plotMulti(numStks, S, T, v, M, mo, bf, fig, seed = None, numWorkers = 1,
+              mode = 'lines', maxPoints = 1000):
     ax = fig.add_subplot(111)
-    for i in range(numStks):
-        v = random.gauss(0.0, volatility/2.0)
-        avgVol += v
-        history = runStockSim('Stock'+str(i), S, T, v, M, mo, bf)
-        ax.plot(history)
-        mean += history[-1]
-    mean = mean/float(numStks)
-    avgVol = avgVol/numStks
+    volSeed, pathSeed = numpy.random.SeedSequence(seed).spawn(2)
+    vols = numpy.random.default_rng(volSeed).normal(0.0, v/2.0, numStks)
+    histories, stats = runEnsemble(numStks, S, T, vols, M, mo, bf, pathSeed, 
+                                   numWorkers)
+    drawEnsemble(ax, histories, mode, maxPoints)
+    mean = stats['mean']
+    avgVol = vols.mean()
     EStk = NewStock('EStk', S, avgVol, T)
     ES_t = stockPrice(EStk, T, M)
     titleP1 = 'Simulation of '+str(numStks)+' Stocks\n'
@@ -248,18 +332,52 @@ def plotMulti(numStks, S, T, v, M, mo, bf, fig):
 # Here are the actual plots that we want
 # For the new plots, we initiate a new figure to work with per plot
 
-# Plot the Black-Scholes model for comparing Put/Call Prices to the market price:
-fig1 = pylab.figure()
-plotGreeks(startPrice, strike, maturity, rfrate, volatility, 'Risk-free-rate', fig1)
-
-# Plot the new Black-Scholes model of a stock simulation:
-#fig2 = pylab.figure()
-#plotStock('ABC', startPrice, numDays, volatility, market, mo, bf, fig2)
+# --- main ---
+# PURPOSE: draws one of the plots above with the global variables as defaults;
+#          with --out the figure is written to each file given instead of 
+#          being shown, e.g.
+#              python stock_plot.py multi --stocks 10000 --mode fan --out fan.png
+# FUNCTION: [Listof String] -> (Void)
 
-# Plot the above except now with options on a twin axis:
-#fig3 = pylab.figure()
-#plotOptions('ABC', startPrice, strike, numDays, volatility, market, mo, bf, fig3)
+def main(argv = None):
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Plot the stock simulator.')
+    parser.add_argument('plot', nargs = '?', default = 'greeks',
+                        choices = ('greeks', 'stock', 'options', 'multi'))
+    parser.add_argument('--stocks', type = int, default = numStks)
+    parser.add_argument('--days', type = int, default = numDays)
+    parser.add_argument('--mode', default = 'lines', 
+                        choices = ('lines', 'collection', 'fan', 'density'))
+    parser.add_argument('--points', type = int, default = 1000, 
+                        help = 'most points drawn per path')
+    parser.add_argument('--mo', action = 'store_true', default = mo)
+    parser.add_argument('--bf', action = 'store_true', default = bf)
+    parser.add_argument('--seed', type = int, default = None)
+    parser.add_argument('--workers', type = int, default = 1)
+    parser.add_argument('--out', action = 'append', default = [], 
+                        help = 'file to write (PNG, SVG, PDF, ...); may be repeated')
+    parser.add_argument('--size', type = float, nargs = 2, default = (16, 9))
+    parser.add_argument('--dpi', type = int, default = 100)
+    args = parser.parse_args(argv)
+    T = args.days
+    draws = {
+        'greeks': lambda fig: plotGreeks(startPrice, strike, maturity, rfrate, 
+                                         volatility, 'Risk-free-rate', fig),
+        'stock': lambda fig: plotStock('ABC', startPrice, T, volatility, market, 
+                                       args.mo, args.bf, fig, maxPoints = args.points),
+        'options': lambda fig: plotOptions('ABC', startPrice, strike, T, volatility,
+                                           market, args.mo, args.bf, fig, 
+                                           maxPoints = args.points),
+        'multi': lambda fig: plotMulti(args.stocks, startPrice, T, volatility, market,
+                                       args.mo, args.bf, fig, args.seed, args.workers,
+                                       args.mode, args.points)}
+    if args.out:
+        for fileName in args.out: 
+            saveFigure(fileName, draws[args.plot], args.size, args.dpi)
+    else:
+        import pylab
+        draws[args.plot](pylab.figure(figsize = args.size))
+        pylab.show()
 
-# Plot a multi-stock simulator:
-#fig4 = pylab.figure()
-#plotMulti(numStks, startPrice, numDays, volatility, market, mo, bf, fig4)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
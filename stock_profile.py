@@ -0,0 +1,179 @@
+# Stock Market Simulation
+
+# Here we instrument the hot paths of the simulator: a Profiler swaps the stage
+# functions (simulation, the trend calendar, the moves and the pricing) for timed
+# wrappers in every loaded stock_ module, counts the random numbers drawn, and
+# optionally traces memory or runs cProfile, e.g.
+#     with Profiler(memory = True) as prof:
+#         runStockSim('A', 1000.0, 1460, 0.3, market, True, True)
+#     prof.save('profile.json')
+# Nothing is wrapped until a Profiler is started and everything is put back when
+# it stops, so the simulator runs its own functions, at full speed, otherwise.
+# Only the current process is instrumented: with runEnsemble over more than one
+# worker, the simulation stages run in the workers and are not in the report.
+
+import cProfile, functools, io, json, pstats, random, sys, time, tracemalloc
+import numpy
+
+# INSTRUMENTATION --------------------------------------------------------------
+
+# The stages timed by default, as (module, name) with name 'Class.method' for
+# methods; stages of modules that are not loaded are skipped
+stages = [('stock_simulator', name) for name in
+          ('runStockSim', 'simulatePaths', 'streamStockSim', 'evolvePaths',
+           'runEnsemble', 'simulatePortfolio', 'priceBook', 'americanPrice',
+           'hedgeBacktest')] + \
+         [('stock_classes', name) for name in
+          ('Stock.makeMove', 'NewStock.makeMove', 'Market.compileCalendar',
+           'Market.getCalendar', 'Market.getShock', 'stockPrice', 'mcStockPrice',
+           'putPrice', 'callPrice', 'optionPrices', 'optionGreeks', 'impliedVol',
+           'PricingCache.prices')] + \
+         [('stock_qmc', 'sobolPoints'), ('stock_qmc', 'sobolNormals')]
+
+# The random number methods whose draws are counted
+draws = ('standard_normal', 'normal', 'uniform', 'integers', 'random', 'choice',
+         'multivariate_normal')
+
+# --- CountingGenerator ---
+# DESCRIPTION: a numpy Generator that counts the numbers drawn by its methods
+#              into the draws table of a Profiler
+# FIELDS: Generator(rng), {String: Nat}(counts)
+
+class CountingGenerator(object):
+    def __init__(self, rng, counts):
+        self.rng = rng
+        self.counts = counts
+    def __getattr__(self, name):
+        attr = getattr(self.rng, name)
+        if name not in draws: return attr
+        def counted(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            self.counts['numpy.' + name] = self.counts.get('numpy.' + name, 0) + numpy.size(result)
+            return result
+        return counted
+
+# --- Profiler ---
+# DESCRIPTION: times the given stages (stages by default) while it is started;
+#              memory traces the peak memory of every stage and profile runs
+#              cProfile over the whole session. report gives calls, total and
+#              mean seconds (and peak MB) per stage, the random numbers drawn
+#              and the cProfile hot spots, and save writes it as JSON.
+# FIELDS: [Listof (String + String)](targets), Boolean(memory), Boolean(profile),
+#         {String: {String: Float}}(stats), {String: Nat}(counts),
+#         [Listof Any](patched), [Listof [Listof Nat]](frames), Profile(cprof),
+#         Float(started), Float(elapsed), Float(peakMB), Boolean(tracing)
+
+class Profiler(object):
+    active = None
+    def __init__(self, targets = None, memory = False, profile = False):
+        self.targets = stages if targets is None else targets
+        self.memory = memory
+        self.profile = profile
+        self.stats = {}
+        self.counts = {}
+        self.patched = []
+        self.frames = []
+        self.cprof = None
+        self.started = None
+        self.elapsed = 0.0
+        self.peakMB = None
+        self.tracing = False
+    def wrap(self, name, func):
+        stat = self.stats.setdefault(name, {'calls': 0, 'seconds': 0.0, 'peakMB': 0.0})
+        frames, memory = self.frames, self.memory
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            stat['calls'] += 1
+            if memory:
+                current, peak = tracemalloc.get_traced_memory()
+                for frame in frames: frame[1] = max(frame[1], peak)
+                tracemalloc.reset_peak()
+                frames.append([current, current])
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stat['seconds'] += time.perf_counter() - start
+                if memory:
+                    first, peak = frames.pop()
+                    peak = max(peak, tracemalloc.get_traced_memory()[1])
+                    if frames: frames[-1][1] = max(frames[-1][1], peak)
+                    stat['peakMB'] = max(stat['peakMB'], (peak - first)/1e6)
+        timed.original = func
+        return timed
+    def patch(self, owner, name, value):
+        self.patched.append((owner, name, owner.__dict__[name] if isinstance(owner, type)
+                             else getattr(owner, name)))
+        setattr(owner, name, value)
+    def start(self):
+        if Profiler.active is not None: raise NameError('A Profiler is already running')
+        Profiler.active = self
+        modules = [m for n, m in list(sys.modules.items())
+                   if n.startswith('stock_') or n == '__main__']
+        main = sys.modules.get('__main__')
+        script = getattr(main, '__file__', None) or ''
+        for moduleName, name in self.targets:
+            homes = [sys.modules.get(moduleName)]
+            # a module run as a script is loaded as __main__, and again under
+            # its own name if another module imports it
+            if script.endswith(moduleName + '.py'): homes.append(main)
+            for home in homes:
+                if home is None: continue
+                if '.' in name:
+                    className, method = name.split('.')
+                    owner = getattr(home, className)
+                    if method not in owner.__dict__: continue
+                    self.patch(owner, method, self.wrap(name, owner.__dict__[method]))
+                    continue
+                func = getattr(home, name)
+                timed = self.wrap(name, func)
+                # from ... import * copies the function into other modules too
+                for module in modules:
+                    if getattr(module, name, None) is func: self.patch(module, name, timed)
+        counts, defaultRng, gauss = self.counts, numpy.random.default_rng, random.gauss
+        def countingRng(*args, **kwargs):
+            return CountingGenerator(defaultRng(*args, **kwargs), counts)
+        def countingGauss(mu, sigma):
+            counts['random.gauss'] = counts.get('random.gauss', 0) + 1
+            return gauss(mu, sigma)
+        self.patch(numpy.random, 'default_rng', countingRng)
+        self.patch(random, 'gauss', countingGauss)
+        self.tracing = self.memory and not tracemalloc.is_tracing()
+        if self.tracing: tracemalloc.start()
+        if self.profile:
+            self.cprof = cProfile.Profile()
+            self.cprof.enable()
+        self.started = time.perf_counter()
+        return self
+    def stop(self):
+        if Profiler.active is not self: return self
+        self.elapsed += time.perf_counter() - self.started
+        if self.cprof is not None: self.cprof.disable()
+        if self.memory:
+            self.peakMB = tracemalloc.get_traced_memory()[1]/1e6
+            if self.tracing: tracemalloc.stop()
+        for owner, name, value in reversed(self.patched):
+            setattr(owner, name, value)
+        self.patched = []
+        Profiler.active = None
+        return self
+    def __enter__(self):
+        return self.start()
+    def __exit__(self, *exc):
+        self.stop()
+    def report(self, top = 20):
+        timed = {}
+        for name, stat in self.stats.items():
+            if not stat['calls']: continue
+            timed[name] = dict(stat, mean = stat['seconds']/stat['calls'])
+            if not self.memory: del timed[name]['peakMB']
+        result = {'seconds': self.elapsed, 'stages': timed, 'draws': dict(self.counts)}
+        if self.memory: result['peakMB'] = self.peakMB
+        if self.cprof is not None:
+            out = io.StringIO()
+            pstats.Stats(self.cprof, stream = out).sort_stats('cumulative').print_stats(top)
+            result['profile'] = out.getvalue()
+        return result
+    def save(self, fileName, top = 20):
+        with open(fileName, 'w') as f:
+            json.dump(self.report(top), f, indent = 1, sort_keys = True)
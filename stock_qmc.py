@@ -0,0 +1,186 @@
+# Stock Market Simulation
+
+# Here we generate quasi-random shocks for the simulator: scrambled Sobol points
+# are turned into normals and then into daily shocks with a Brownian bridge, so
+# that the first (best distributed) coordinates of each point decide the overall
+# shape of the path and the later ones only fill in the details. Each seed gives
+# an independent scrambling, so running several seeds gives an error estimate.
+
+import numpy
+from stock_classes import invPhi
+
+# SOBOL POINTS -----------------------------------------------------------------
+
+bits = 32
+
+# Initial direction numbers of the first Sobol dimensions after the first one,
+# from Joe and Kuo (2008); later dimensions use random odd initial numbers
+joeKuo = [[1], [1, 3], [1, 3, 1], [1, 1, 1], [1, 1, 3, 3], [1, 3, 5, 13],
+          [1, 1, 5, 5, 17], [1, 1, 5, 5, 5], [1, 1, 7, 11, 19], [1, 1, 5, 1, 1],
+          [1, 1, 1, 3, 11], [1, 3, 5, 5, 31], [1, 3, 3, 9, 7, 49],
+          [1, 1, 1, 15, 21, 21], [1, 3, 1, 13, 27, 49], [1, 1, 1, 15, 7, 5],
+          [1, 3, 1, 15, 13, 25], [1, 1, 5, 5, 19, 61]]
+
+# Primitive polynomials found so far as (degree, inner coefficients), and the
+# direction numbers built from them; both only grow as more dimensions are used
+polys = []
+directions = numpy.zeros((0, bits), dtype = numpy.uint64)
+
+# --- polyMulMod ---
+# PURPOSE: multiplies two polynomials over GF(2) (as bit masks) modulo p, a
+#          polynomial of degree s
+# FUNCTION: Nat + Nat + Nat + Nat -> Nat
+
+def polyMulMod(a, b, p, s):
+    result = 0
+    while b:
+        if b & 1: result ^= a
+        b >>= 1
+        a <<= 1
+        if a >> s & 1: a ^= p
+    return result
+
+# --- polyPowMod ---
+# PURPOSE: raises a polynomial over GF(2) to the power e modulo p
+# FUNCTION: Nat + Nat + Nat + Nat -> Nat
+
+def polyPowMod(a, e, p, s):
+    result = 1
+    while e:
+        if e & 1: result = polyMulMod(result, a, p, s)
+        a = polyMulMod(a, a, p, s)
+        e >>= 1
+    return result
+
+# --- primitivePolys ---
+# PURPOSE: the primitive polynomials of degree s, in the order used by Joe and
+#          Kuo; p is primitive when x has order exactly 2^s - 1 modulo p
+# FUNCTION: Nat -> [Listof Nat]
+
+def primitivePolys(s):
+    order = 2**s - 1
+    factors, n, q = [], order, 2
+    while q*q <= n:
+        if n % q == 0:
+            factors.append(q)
+            while n % q == 0: n //= q
+        q += 1
+    if n > 1: factors.append(n)
+    found = []
+    for a in range(2**(s-1)):
+        p = (1 << s) | (a << 1) | 1
+        x = 2 % p if s > 1 else 1
+        if polyPowMod(x, order, p, s) != 1: continue
+        if any(polyPowMod(x, order//q, p, s) == 1 for q in factors): continue
+        found.append(a)
+    return found
+
+# --- directionNumbers ---
+# PURPOSE: the direction numbers of the first dims Sobol dimensions as a dims by
+#          bits array (the k-th number of a dimension is its m_k shifted to the
+#          k-th binary digit)
+# FUNCTION: Nat -> [Arrayof Nat]
+
+def directionNumbers(dims):
+    global directions
+    if len(directions) >= dims: return directions[:dims]
+    degree = polys[-1][0] if polys else 0
+    while len(polys) < dims - 1:
+        degree += 1
+        polys.extend((degree, a) for a in primitivePolys(degree))
+    rng = numpy.random.default_rng(2011) #fixed, so that the points never change
+    rows = [[1 << (bits - k) for k in range(1, bits+1)]]
+    for j, (s, a) in enumerate(polys[:dims-1]):
+        m = list(joeKuo[j]) if j < len(joeKuo) else \
+            [int(rng.integers(0, 2**(k-1)))*2 + 1 for k in range(1, s+1)]
+        for k in range(s, bits):
+            new = m[k-s] ^ (m[k-s] << s)
+            for i in range(1, s):
+                if a >> (s-1-i) & 1: new ^= m[k-i] << i
+            m.append(new)
+        rows.append([m[k] << (bits - 1 - k) for k in range(bits)])
+    directions = numpy.array(rows, dtype = numpy.uint64)
+    return directions
+
+# --- parity ---
+# PURPOSE: the parity of the bits of each (64 bit) number
+# FUNCTION: [Arrayof Nat] -> [Arrayof Nat]
+
+def parity(x):
+    for shift in (32, 16, 8, 4, 2, 1):
+        x = x ^ (x >> numpy.uint64(shift))
+    return x & numpy.uint64(1)
+
+# --- sobolPoints ---
+# PURPOSE: the first numPoints points of the dims dimensional Sobol sequence in
+#          (0,1); with scramble (the default), the direction numbers are mixed
+#          with a random lower triangular matrix and the points get a random
+#          digital shift (Owen's linear scrambling), drawn from seed
+# FUNCTION: Nat + Nat + Nat + Boolean -> [Arrayof Float] (numPoints by dims)
+
+def sobolPoints(numPoints, dims, seed = None, scramble = True):
+    if numPoints > 2**bits: raise NameError('Too many points')
+    V = directionNumbers(dims).copy()
+    shift = numpy.zeros(dims, dtype = numpy.uint64)
+    if scramble:
+        rng = numpy.random.default_rng(seed)
+        one = numpy.uint64(1)
+        scrambled = numpy.zeros_like(V)
+        for row in range(bits):
+            # row-th digit = the diagonal one plus random digits before it
+            mask = rng.integers(0, 2**row, dims, dtype = numpy.uint64) << numpy.uint64(bits - row)
+            mask |= one << numpy.uint64(bits - 1 - row)
+            scrambled |= parity(V & mask[:, None]) << numpy.uint64(bits - 1 - row)
+        V = scrambled
+        shift = rng.integers(0, 2**bits, dims, dtype = numpy.uint64)
+    index = numpy.arange(numPoints, dtype = numpy.uint64)
+    X = numpy.zeros((numPoints, dims), dtype = numpy.uint64) ^ shift
+    for k in range(max(numPoints - 1, 1).bit_length()):
+        X[(index >> numpy.uint64(k)) & numpy.uint64(1) == 1] ^= V[:, k]
+    return (X + 0.5)/2.0**bits
+
+# BROWNIAN BRIDGE --------------------------------------------------------------
+
+# --- bridgeIncrements ---
+# PURPOSE: turns independent normals (one row per path) into the daily shocks
+#          of a Brownian path with a Brownian bridge: the first column sets the
+#          final value, the next ones the midpoints of the remaining gaps, and so
+#          on; returns the increments, which are again independent normals
+# FUNCTION: [Arrayof Float] -> [Arrayof Float]
+
+def bridgeIncrements(z):
+    n = z.shape[1]
+    W = numpy.empty_like(z)
+    filled = numpy.zeros(n, dtype = bool)
+    filled[n-1] = True
+    W[:, n-1] = numpy.sqrt(n)*z[:, 0]
+    left = 0
+    for i in range(1, n):
+        while filled[left]: left += 1
+        right = left
+        while not filled[right]: right += 1
+        mid = left + (right - 1 - left)//2
+        filled[mid] = True
+        span = right + 1 - left
+        W[:, mid] = (right - mid)/span*(W[:, left-1] if left else 0.0) + \
+                    (mid + 1 - left)/span*W[:, right] + \
+                    numpy.sqrt((mid + 1 - left)*(right - mid)/span)*z[:, i]
+        left = right + 1
+        if left >= n: left = 0
+    return numpy.diff(W, axis = 1, prepend = 0.0)
+
+# --- sobolNormals ---
+# PURPOSE: the daily shocks of numPaths paths over numDays days from scrambled
+#          Sobol points and a Brownian bridge; only the first sobolDims bridge
+#          coordinates come from the Sobol points (all of them by default), the
+#          rest are pseudo-random
+# FUNCTION: Nat + Nat + Nat + Nat -> [Arrayof Float] (numPaths by numDays)
+
+def sobolNormals(numPaths, numDays, seed = None, sobolDims = None):
+    seed = numpy.random.SeedSequence(seed)
+    qmcSeed, mcSeed = seed.spawn(2)
+    dims = numDays if sobolDims is None else min(sobolDims, numDays)
+    z = numpy.empty((numPaths, numDays))
+    z[:, :dims] = invPhi(sobolPoints(numPaths, dims, qmcSeed))
+    z[:, dims:] = numpy.random.default_rng(mcSeed).standard_normal((numPaths, numDays - dims))
+    return bridgeIncrements(z)
@@ -0,0 +1,181 @@
+# Stock Market Simulation
+
+# Here we sweep the simulator over a grid of scenarios (the parameters that are
+# global variables in stock_plot), e.g.
+#     python stock_scenarios.py --grid volatility=0.1,0.2,0.3 --grid mo=0,1
+#                               --workers 4 --out sweep.json
+# Every scenario simulates an ensemble, then prices the put and call of
+# stock_plot both with Black-Scholes and from the simulated paths. The results
+# are kept in a cache directory under a hash of the parameters (seed included),
+# so a sweep that is run again only computes the scenarios that are new or have
+# changed.
+
+import argparse, concurrent.futures, hashlib, itertools, json, math, os, sys
+import numpy
+from stock_classes import *
+from stock_simulator import *
+
+# SCENARIOS --------------------------------------------------------------------
+
+# Bump when the results of runScenario change, so old cache entries are ignored
+version = 2
+
+# The parameters of a scenario, with the defaults of stock_plot
+defaults = {'volatility': 0.3, 'rfrate': 0.04, 'mo': False, 'bf': False,
+            'numDays': 1460, 'numStks': 15, 'months': 4.0, 'startPrice': 1000.0,
+            'seed': 0}
+
+# --- scenarioGrid ---
+# PURPOSE: every combination of the values given for each parameter, filled in
+#          with defaults for the other parameters
+# FUNCTION: {String: [Listof Any]} -> [Listof {String: Any}]
+
+def scenarioGrid(axes):
+    for name in axes:
+        if name not in defaults: raise NameError('No such parameter: ' + name)
+    names = sorted(axes)
+    return [dict(defaults, **dict(zip(names, values)))
+            for values in itertools.product(*[axes[name] for name in names])]
+
+# --- scenarioKey ---
+# PURPOSE: the hash that a scenario's result is cached under; it covers all of
+#          the parameters (with their defaults) and the version of the results
+# FUNCTION: {String: Any} -> String
+
+def scenarioKey(params):
+    params = dict(defaults, **params)
+    text = json.dumps({'version': version, 'params': params}, sort_keys = True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+# --- runScenario ---
+# PURPOSE: simulates the numStks stocks of a scenario (with trends if bf) and
+#          prices a put and a call struck at the forward price of startPrice
+#          that mature after months months: with Black-Scholes and as the
+#          discounted average payoff over the simulated paths (the paths are
+#          simulated for at least the maturity). Both are priced at the expiry,
+#          the maturity rounded to whole days. Returns the closing price
+#          statistics and the prices.
+# FUNCTION: {String: Any} -> {String: Any}
+
+def runScenario(params):
+    p = dict(defaults, **params)
+    S, v, r = p['startPrice'], p['volatility'], p['rfrate']
+    maturity = 365.0/12.0*p['months']
+    strike = S*math.exp(maturity/365.0*r)
+    expiry = int(round(maturity))
+    numDays = max(p['numDays'], expiry)
+    market = Market(r, defaultTrends(v))
+    paths, stats = runEnsemble(p['numStks'], S, numDays, v, market, p['mo'], p['bf'],
+                               p['seed'])
+    if numDays != p['numDays']: stats = closingStats(paths[:, :p['numDays']+1])
+    final = paths[:, expiry]
+    disc = math.exp(-r*expiry/365.0)
+    # Black-Scholes on the same whole number of days as the simulated payoffs
+    put, call = optionPrices(S, strike, expiry, r, v)
+    return {'closing': stats, 'strike': strike, 'maturity': maturity, 'expiry': expiry,
+            'blackScholes': {'put': float(put), 'call': float(call)},
+            'simulated': {'put': disc*float(numpy.maximum(strike - final, 0.0).mean()),
+                          'call': disc*float(numpy.maximum(final - strike, 0.0).mean())}}
+
+# RESULT CACHE -----------------------------------------------------------------
+
+# --- cacheFile ---
+# PURPOSE: the file that the result with the given key is kept in
+# FUNCTION: String + String -> String
+
+def cacheFile(cacheDir, key):
+    return os.path.join(cacheDir, key[:2], key + '.json')
+
+# --- loadResult ---
+# PURPOSE: the cached result with the given key, or None
+# FUNCTION: String + String -> {String: Any}
+
+def loadResult(cacheDir, key):
+    try:
+        with open(cacheFile(cacheDir, key)) as f:
+            return json.load(f)['result']
+    except (IOError, ValueError, KeyError):
+        return None
+
+# --- saveResult ---
+# PURPOSE: caches the result of a scenario; it is written to a temporary file
+#          first, so an interrupted run never leaves a broken entry behind
+# FUNCTION: String + String + {String: Any} + {String: Any} -> (Void)
+
+def saveResult(cacheDir, key, params, result):
+    fileName = cacheFile(cacheDir, key)
+    os.makedirs(os.path.dirname(fileName), exist_ok = True)
+    with open(fileName + '.tmp', 'w') as f:
+        json.dump({'version': version, 'params': params, 'result': result}, f,
+                  indent = 1, sort_keys = True)
+    os.replace(fileName + '.tmp', fileName)
+
+# --- runScenarios ---
+# PURPOSE: runs a list of scenarios over a pool of numWorkers processes and
+#          returns their (params, result) in order; results found in cacheDir
+#          are reused (unless refresh) and new ones are cached as soon as they
+#          finish. Also returns the number of cache hits and of scenarios run.
+# FUNCTION: [Listof {String: Any}] + String + Nat + Boolean
+#           -> [Listof ({String: Any} + {String: Any})] + {String: Nat}
+
+def runScenarios(scenarios, cacheDir = 'scenario_cache', numWorkers = 1,
+                 refresh = False):
+    scenarios = [dict(defaults, **params) for params in scenarios]
+    keys = [scenarioKey(params) for params in scenarios]
+    results = [None if refresh else loadResult(cacheDir, key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    # the same scenario may appear more than once in a list, but only runs once
+    todo = list(dict((keys[i], i) for i in missing).values())
+    def finish(i, result):
+        saveResult(cacheDir, keys[i], scenarios[i], result)
+        for j in missing:
+            if keys[j] == keys[i]: results[j] = result
+    if numWorkers > 1 and len(todo) > 1:
+        with concurrent.futures.ProcessPoolExecutor(numWorkers) as pool:
+            futures = dict((pool.submit(runScenario, scenarios[i]), i) for i in todo)
+            for future in concurrent.futures.as_completed(futures):
+                finish(futures[future], future.result())
+    else:
+        for i in todo: finish(i, runScenario(scenarios[i]))
+    counts = {'scenarios': len(scenarios), 'cached': len(scenarios) - len(missing),
+              'run': len(todo)}
+    return list(zip(scenarios, results)), counts
+
+# COMMAND LINE -----------------------------------------------------------------
+
+# --- parseAxis ---
+# PURPOSE: reads a --grid option of the form name=value,value,... with the
+#          values in the type of the parameter's default
+# FUNCTION: String -> String + [Listof Any]
+
+def parseAxis(text):
+    name, values = text.split('=', 1)
+    if name not in defaults: raise NameError('No such parameter: ' + name)
+    kind = type(defaults[name])
+    if kind is bool: convert = lambda x: x.strip().lower() in ('1', 'true', 'yes')
+    else: convert = lambda x: kind(json.loads(x))
+    return name, [convert(value) for value in values.split(',')]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Run a grid of stock scenarios.')
+    parser.add_argument('--grid', action = 'append', default = [],
+                        help = 'name=value,value,... (may be repeated)')
+    parser.add_argument('--workers', type = int, default = 1)
+    parser.add_argument('--cache', default = 'scenario_cache')
+    parser.add_argument('--refresh', action = 'store_true',
+                        help = 'run every scenario even if it is cached')
+    parser.add_argument('--out', default = None, help = 'write the results here')
+    args = parser.parse_args(argv)
+    scenarios = scenarioGrid(dict(parseAxis(axis) for axis in args.grid))
+    results, counts = runScenarios(scenarios, args.cache, args.workers, args.refresh)
+    sys.stderr.write('%(scenarios)d scenarios: %(cached)d cached, %(run)d run\n' % counts)
+    rows = [{'params': params, 'result': result} for params, result in results]
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(rows, f, indent = 1, sort_keys = True)
+    else:
+        json.dump(rows, sys.stdout, indent = 1, sort_keys = True)
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+# Stock Market Simulation
+
+# Here we serve Black-Scholes prices to other programs on this machine, e.g.
+#     python stock_service.py --port 8765          (or --unix /tmp/stock.sock)
+# Clients send one JSON request per line, such as
+#     {"id": 7, "kind": "call", "S": 1000, "K": 1013.4, "T": 121.7, "r": 0.04, "v": 0.3}
+# (kind is 'put', 'call' or 'both'; t is optional), and get one JSON line back per
+# request, with the same id, holding the price (or 'put' and 'call', or an
+# 'error', e.g. for inputs that are not finite or an S, K or v that is not 
+# positive). Requests can be pipelined, and answers may come back out of order.
+# {"op": "stats"} returns the counters of the service. Requests that arrive
+# together are collected into micro-batches: a batch is priced with a single
+# optionPrices call once it has maxBatch requests or maxDelay seconds after its
+# first request, whichever comes first, so the delay added to a request is
+# bounded.
+
+import argparse, asyncio, collections, json, math, socket, sys, threading, time
+import numpy
+from stock_classes import *
+
+# PRICING SERVICE --------------------------------------------------------------
+
+# The inputs of a request, with their defaults (None = required); all of them
+# must be finite numbers, and the ones in positive greater than zero
+fields = (('S', None), ('K', None), ('T', None), ('r', None), ('v', None), ('t', 0.0))
+positive = ('S', 'K', 'v')
+
+# --- PricingService ---
+# DESCRIPTION: collects pricing requests into batches that are priced with one
+#              optionPrices call; price is awaited once per request. Keeps the
+#              number of requests, batches and errors and the latencies of the
+#              last numLatencies requests for stats.
+# FIELDS: Nat(maxBatch), Float(maxDelay), [Listof Any](pending), TimerHandle(timer),
+#         Nat(requests), Nat(batches), Nat(errors), Deque(latencies),
+#         Float(started)
+
+class PricingService(object):
+    def __init__(self, maxBatch = 1024, maxDelay = 0.002, numLatencies = 10000):
+        self.maxBatch = maxBatch
+        self.maxDelay = maxDelay
+        self.pending = []
+        self.timer = None
+        self.requests = self.batches = self.errors = 0
+        self.latencies = collections.deque(maxlen = numLatencies)
+        self.started = time.perf_counter()
+    def price(self, request):
+        kind = request.get('kind', 'both')
+        if kind not in ('put', 'call', 'both'): raise NameError('No such option')
+        inputs = []
+        for name, default in fields:
+            value = request.get(name, default)
+            if value is None: raise NameError('Missing ' + name)
+            value = float(value)
+            if not math.isfinite(value) or (name in positive and value <= 0):
+                raise NameError('Bad ' + name)
+            inputs.append(value)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((inputs, kind, future, time.perf_counter()))
+        if len(self.pending) >= self.maxBatch: self.flush()
+        elif self.timer is None: self.timer = loop.call_later(self.maxDelay, self.flush)
+        return future
+    def flush(self):
+        if self.timer is not None: self.timer.cancel()
+        self.timer = None
+        batch, self.pending = self.pending, []
+        if not batch: return
+        self.batches += 1
+        self.requests += len(batch)
+        try:
+            inputs = numpy.array([inputs for inputs, kind, future, start in batch])
+            with numpy.errstate(over = 'ignore', invalid = 'ignore'):
+                puts, calls = optionPrices(*inputs.T)
+            puts, calls = puts.tolist(), calls.tolist()
+        except Exception as error:
+            # this runs from a timer, so the error must reach every request
+            for inputs, kind, future, start in batch:
+                if not future.done(): future.set_exception(error)
+            return
+        done = time.perf_counter()
+        for (inputs, kind, future, start), put, call in zip(batch, puts, calls):
+            self.latencies.append(done - start)
+            if future.done(): continue
+            # finite but extreme inputs can still overflow
+            if not (math.isfinite(put) and math.isfinite(call)):
+                future.set_exception(NameError('Price is not finite'))
+            elif kind == 'put': future.set_result({'price': put})
+            elif kind == 'call': future.set_result({'price': call})
+            else: future.set_result({'put': put, 'call': call})
+    def stats(self):
+        uptime = time.perf_counter() - self.started
+        result = {'requests': self.requests, 'batches': self.batches,
+                  'errors': self.errors, 'uptime': uptime,
+                  'throughput': self.requests/uptime,
+                  'meanBatch': self.requests/float(self.batches or 1)}
+        if self.latencies:
+            p50, p99, p999 = numpy.percentile(self.latencies, (50, 99, 99.9)).tolist()
+            result.update(latencyP50 = p50, latencyP99 = p99, latencyP999 = p999,
+                          latencyMax = max(self.latencies))
+        return result
+    async def answer(self, line, writer):
+        reply = {}
+        try:
+            request = json.loads(line)
+            reply['id'] = request.get('id')
+            if request.get('op') == 'stats': reply.update(self.stats())
+            else: reply.update(await self.price(request))
+        except Exception as error:
+            self.errors += 1
+            reply['error'] = str(error)
+        try:
+            text = json.dumps(reply, allow_nan = False)
+        except ValueError:
+            self.errors += 1
+            text = json.dumps({'id': reply.get('id'), 'error': 'Reply is not finite'})
+        writer.write((text + '\n').encode())
+    async def serve(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line: break
+                if not line.strip(): continue
+                task = asyncio.ensure_future(self.answer(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                # stop reading a client that does not read its answers
+                if writer.transport.get_write_buffer_size() > 1 << 20: await writer.drain()
+            if tasks: await asyncio.wait(tasks)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+# --- startService ---
+# PURPOSE: starts a PricingService listening on a Unix socket (if path is given)
+#          or on host:port, and returns the service and the server
+# FUNCTION: String + Nat + String + Nat + Float -> PricingService + Server
+
+async def startService(host = '127.0.0.1', port = 8765, path = None,
+                       maxBatch = 1024, maxDelay = 0.002):
+    service = PricingService(maxBatch, maxDelay)
+    if path: server = await asyncio.start_unix_server(service.serve, path)
+    else: server = await asyncio.start_server(service.serve, host, port)
+    return service, server
+
+# CLIENT -----------------------------------------------------------------------
+
+# --- priceRemote ---
+# PURPOSE: sends a list of requests to a running service at once and returns
+#          the replies in the same order; a simple blocking client for tools
+#          that do not use asyncio
+# FUNCTION: [Listof {String: Any}] + String + Nat + String -> [Listof {String: Any}]
+
+def priceRemote(requests, host = '127.0.0.1', port = 8765, path = None):
+    if path:
+        sock = socket.socket(socket.AF_UNIX)
+        sock.connect(path)
+    else: sock = socket.create_connection((host, port))
+    def send():
+        with sock.makefile('wb') as f:
+            for i, request in enumerate(requests):
+                f.write((json.dumps(dict(request, id = i)) + '\n').encode())
+        sock.shutdown(socket.SHUT_WR)
+    # the requests are sent while the replies are read, so neither side blocks
+    sender = threading.Thread(target = send)
+    with sock, sock.makefile('rb') as f:
+        sender.start()
+        replies = [None]*len(requests)
+        for line in f:
+            reply = json.loads(line)
+            replies[reply.pop('id')] = reply
+        sender.join()
+    return replies
+
+# COMMAND LINE -----------------------------------------------------------------
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Serve Black-Scholes prices.')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8765)
+    parser.add_argument('--unix', default = None, help = 'listen on this Unix socket')
+    parser.add_argument('--max-batch', type = int, default = 1024)
+    parser.add_argument('--max-delay', type = float, default = 0.002,
+                        help = 'longest wait (in seconds) for a batch to fill')
+    args = parser.parse_args(argv)
+    async def run():
+        service, server = await startService(args.host, args.port, args.unix,
+                                             args.max_batch, args.max_delay)
+        sys.stderr.write('Serving on %s\n' % (args.unix or '%s:%d' % (args.host, args.port)))
+        async with server:
+            await server.serve_forever()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -9,14 +9,11 @@
 # that the efficient market hypothesis holds true; this simulation will be a 
 # modified version of a random walk
 
-import math, pylab, random
-from stock_classes import *
-from stock_simulator import *
-
 # SIMULATOR --------------------------------------------------------------------
 
-import math, pylab, random
+import argparse, concurrent.futures, json, math, numpy, random, sys
 from stock_classes import *
+from stock_qmc import sobolNormals
 
 # Here, we define a couple functions:
 
@@ -26,6 +23,7 @@ from stock_classes import *
 # FUNCTION: (Void) -> (Void)
 
 def unitTestStock():
+    import pylab
     def runSim(stks, fig, mo):
         mean = 0.0
         for s in stks:
@@ -54,18 +52,422 @@ def unitTestStock():
 
 # ----------------- Here are my modifications ----------------------------------
 
+# Batches of at most this many stocks are evolved one stock at a time (with mo)
+smallBatch = 16
+
+# --- evolvePaths ---
+# PURPOSE: advances a batch of stocks from their current state, writing one
+#          column of out per day; this is NewStock.makeMove for many stocks at
+#          once, so it keeps the same absorbing floor at 0.01 and the same mo
+#          correction. Without mo the log-prices are a cumulative sum of the
+#          daily steps. Returns the new (prices, lastChanges) state.
+# FUNCTION: [Arrayof Float] + [Arrayof Float] + [Arrayof Float] + Float + 
+#           Float + [Arrayof Float] + [Arrayof Float] + [Arrayof Float] + 
+#           Float -> [Arrayof Float] + [Arrayof Float]
+# Note: z = standard normal shocks, one per stock per day
+#       moves = gauss(0.5,0.5) momentum draws (None if mo is off)
+#       factors = trend factors per day (None if bf is off)
+
+def evolvePaths(out, price, lastChange, drift, vol, z, moves, factors, deltat):
+    growth = (drift - vol**2/2)*deltat + vol*z*math.sqrt(deltat)
+    if moves is None:
+        if factors is not None:
+            growth = growth + numpy.log(factors)
+        out[:] = price[:, None]*numpy.exp(numpy.cumsum(growth, axis=1))
+        out[numpy.logical_or.accumulate(out < 0.01, axis=1)] = 0.0
+        oldPrice = out[:, -2] if out.shape[1] > 1 else price
+        if factors is not None: oldPrice = oldPrice*factors[-1]
+        return out[:, -1].copy(), oldPrice - out[:, -1]
+    growth = numpy.exp(growth)
+    if out.shape[0] <= smallBatch:
+        # a day of a few stocks is quicker in floats than in numpy
+        calendar = None if factors is None else factors.tolist()
+        price, lastChange = price.tolist(), lastChange.tolist()
+        for i in range(out.shape[0]):
+            p, last, row = price[i], lastChange[i], growth[i].tolist()
+            for d, move in enumerate(moves[i].tolist()):
+                if calendar is not None:
+                    p = p*calendar[d]
+                oldPrice = p
+                p = oldPrice*row[d] + move*last
+                if p < 0.01:
+                    p = 0.0
+                row[d] = p
+                last = oldPrice - p
+            out[i] = row
+            price[i], lastChange[i] = p, last
+        return numpy.array(price), numpy.array(lastChange)
+    for d in range(out.shape[1]):
+        if factors is not None:
+            price = price*factors[d]
+        oldPrice = price
+        price = oldPrice*growth[:, d] + moves[:, d]*lastChange
+        price[price < 0.01] = 0.0
+        out[:, d] = price
+        lastChange = oldPrice - price
+    return price, lastChange
+
+# --- simulatePaths ---
+# PURPOSE: runs many stock simulations at once; the stocks are Ito processes
+#          like in runStockSim, but the normal draws for every stock and day
+#          are made in one call. The volatility may be a single number or one
+#          value per path.
+#          With sampler = 'sobol' the shocks come from scrambled Sobol points
+#          and a Brownian bridge (see stock_qmc) instead.
+# FUNCTION: Float + Nat + Float + Market + Boolean + Boolean + Nat + Nat 
+#           + Type + String -> [Arrayof Float] (numPaths by numDays+1)
+
+def simulatePaths(startPrice, numDays, volatility, market, mo, bf, numPaths = 1,
+                  seed = None, dtype = numpy.float64, sampler = 'random'):
+    rng = numpy.random.default_rng(seed)
+    vol = numpy.asarray(volatility, dtype = float)
+    if vol.ndim: vol = vol.reshape(-1, 1)
+    paths = numpy.empty((numPaths, numDays+1), dtype = dtype)
+    paths[:, 0] = startPrice
+    if numDays == 0: return paths
+    if sampler == 'sobol': z = sobolNormals(numPaths, numDays, rng.integers(2**63))
+    elif sampler == 'random': z = rng.standard_normal((numPaths, numDays))
+    else : raise NameError('No such sampler')
+    moves = rng.normal(0.5, 0.5, (numPaths, numDays)) if mo else None
+    factors = market.getCalendar(numDays) if bf else None
+    evolvePaths(paths[:, 1:], numpy.full(numPaths, float(startPrice)), 
+                numpy.zeros(numPaths), market.getDrift(), vol, z, moves, 
+                factors, 1.0/365.0)
+    return paths
+
+# --- streamStockSim ---
+# PURPOSE: a generator version of simulatePaths for long or unbounded horizons
+#          (numDays = None); yields the new prices of every path in chunks of 
+#          chunkSize days, with ticksPerDay prices per day, and only keeps the
+#          current state in between, so the memory used does not grow with the
+#          horizon. The next chunk is only simulated once it is asked for.
+# FUNCTION: Float + Float + Market + Boolean + Boolean + Nat + Nat + Nat + Nat 
+#           + Nat -> [Generatorof [Arrayof Float]] (numPaths by chunkSize*ticksPerDay)
+
+def streamStockSim(startPrice, volatility, market, mo, bf, numDays = None, 
+                   numPaths = 1, chunkSize = 30, ticksPerDay = 1, seed = None):
+    rng = numpy.random.default_rng(seed)
+    vol = numpy.asarray(volatility, dtype = float)
+    if vol.ndim: vol = vol.reshape(-1, 1)
+    price = numpy.full(numPaths, float(startPrice))
+    lastChange = numpy.zeros(numPaths)
+    deltat = 1.0/(365.0*ticksPerDay)
+    day = 0
+    while numDays is None or day < numDays:
+        days = chunkSize if numDays is None else min(chunkSize, numDays - day)
+        n = days*ticksPerDay
+        z = rng.standard_normal((numPaths, n))
+        moves = rng.normal(0.5, 0.5, (numPaths, n)) if mo else None
+        factors = None
+        if bf:                  #trends hit the first tick of their day
+            factors = numpy.ones(n)
+            factors[::ticksPerDay] = market.getCalendar(days, day)
+        out = numpy.empty((numPaths, n))
+        price, lastChange = evolvePaths(out, price, lastChange, market.getDrift(),
+                                        vol, z, moves, factors, deltat)
+        day += days
+        yield out
+
 # --- runStockSim ---
 # PURPOSE: runs a stock simulation based on specified parameters; assumes the
 #          stock is an Ito process; will run only a single stock for a specified
-#          number of days
+#          number of days (a single path of simulatePaths)
 # FUNCTION: String + Float + Nat + Float + Market + Boolean + Boolean -> [Listof Float]
 
-def runStockSim(name, startPrice, numDays, volatility, market, mo, bf):
-    stock = NewStock(name, startPrice, volatility, numDays)
-    for d in range(numDays):
-        if bf:                                   #only if BF is true
-            for date in market.getTrends():
-                if date.day-7 == d % 365: 
-                    stock.price *= (1 + date.factor)
-        stock.makeMove(market.getDrift(), mo)
-    return stock.history
+def runStockSim(name, startPrice, numDays, volatility, market, mo, bf, seed = None):
+    return simulatePaths(startPrice, numDays, volatility, market, mo, bf, 
+                         1, seed)[0].tolist()
+
+# --- simulateBlock ---
+# PURPOSE: simulates one block of an ensemble; kept at the module level so that
+#          it can be sent to the worker processes of runEnsemble
+# FUNCTION: (Float + Nat + [Arrayof Float] + Market + Boolean + Boolean + 
+#           SeedSequence + Type) -> [Arrayof Float]
+
+def simulateBlock(job):
+    startPrice, numDays, vols, market, mo, bf, seed, dtype = job
+    return simulatePaths(startPrice, numDays, vols, market, mo, bf, len(vols),
+                         seed, dtype)
+
+# --- closingStats ---
+# PURPOSE: some statistics of the closing prices of an ensemble
+# FUNCTION: [Arrayof Float] -> {String: Float}
+
+def closingStats(paths):
+    final = numpy.asarray(paths[:, -1], dtype = float)
+    stats = {'mean': final.mean(), 'std': final.std(), 'min': final.min(),
+             'max': final.max(), 'median': numpy.median(final),
+             'p05': numpy.percentile(final, 5), 'p95': numpy.percentile(final, 95)}
+    return dict((key, float(val)) for key, val in stats.items())
+
+# --- ensembleBlocks ---
+# PURPOSE: simulates numPaths stocks split into blocks of blockSize paths over
+#          a pool of numWorkers processes and yields the blocks in order. Every
+#          block gets its own random stream spawned from the master seed, so the
+#          paths only depend on the seed and blockSize and never on the number
+#          of workers.
+# FUNCTION: Nat + Float + Nat + Float + Market + Boolean + Boolean + Nat + Nat 
+#           + Nat -> [Generatorof [Arrayof Float]]
+# Note: volatility may also be one value per path; seed may be a SeedSequence
+
+def ensembleBlocks(numPaths, startPrice, numDays, volatility, market, mo, bf, 
+                   seed = 0, numWorkers = 1, blockSize = 1000, dtype = numpy.float64):
+    if not isinstance(seed, numpy.random.SeedSequence):
+        seed = numpy.random.SeedSequence(seed)
+    vols = numpy.broadcast_to(numpy.asarray(volatility, dtype = float), (numPaths,))
+    jobs = []
+    for i, first in enumerate(range(0, numPaths, blockSize)):
+        stream = numpy.random.SeedSequence(seed.entropy, 
+                                           spawn_key = seed.spawn_key + (i,))
+        jobs.append((startPrice, numDays, numpy.array(vols[first:first+blockSize]),
+                     market, mo, bf, stream, dtype))
+    if numWorkers > 1:
+        with concurrent.futures.ProcessPoolExecutor(numWorkers) as pool:
+            for block in pool.map(simulateBlock, jobs):
+                yield block
+    else:
+        for job in jobs:
+            yield simulateBlock(job)
+
+# --- runEnsemble ---
+# PURPOSE: runs an ensemble of stock simulations with ensembleBlocks; returns 
+#          the histories and some statistics of the closing prices
+# FUNCTION: Nat + Float + Nat + Float + Market + Boolean + Boolean + Nat + Nat 
+#           + Nat -> [Arrayof Float] + {String: Float}
+
+def runEnsemble(numPaths, startPrice, numDays, volatility, market, mo, bf, 
+                seed = 0, numWorkers = 1, blockSize = 1000, dtype = numpy.float64):
+    paths = numpy.concatenate(list(ensembleBlocks(numPaths, startPrice, numDays, 
+                                                  volatility, market, mo, bf, seed,
+                                                  numWorkers, blockSize, dtype)))
+    return paths, closingStats(paths)
+
+# --- correlationFactor ---
+# PURPOSE: factors a correlation matrix C into L with L*L^T = C (Cholesky); if
+#          C is not positive definite (e.g. it was estimated), its negative 
+#          eigenvalues are clipped to zero first. A single number is taken to be
+#          the correlation between every pair of the numAssets assets.
+# FUNCTION: [Arrayof Float] + Nat -> [Arrayof Float]
+
+def correlationFactor(corr, numAssets):
+    corr = numpy.asarray(corr, dtype = float)
+    if corr.ndim == 0:
+        corr = numpy.full((numAssets, numAssets), float(corr))
+        numpy.fill_diagonal(corr, 1.0)
+    try:
+        return numpy.linalg.cholesky(corr)
+    except numpy.linalg.LinAlgError:
+        vals, vecs = numpy.linalg.eigh(corr)
+        L = vecs*numpy.sqrt(numpy.maximum(vals, 0.0))
+        return L/numpy.sqrt((L**2).sum(axis = 1))[:, None] #keep a unit diagonal
+
+# --- simulatePortfolio ---
+# PURPOSE: simulates a book of correlated stocks in the same market; the 
+#          correlation matrix is factored once and the shocks of every path, 
+#          day and stock are drawn together and correlated with one matrix 
+#          product, then every stock evolves as in simulatePaths. Returns the
+#          prices (numPaths by numAssets by numDays+1) and the value of the 
+#          portfolio holding the given number of shares of each stock (by
+#          default the same amount of money in each, one unit in total).
+# FUNCTION: [Arrayof Float] + Nat + [Arrayof Float] + [Arrayof Float] + Market 
+#           + Boolean + Boolean + [Arrayof Float] + Nat + Nat 
+#           -> [Arrayof Float] + [Arrayof Float]
+
+def simulatePortfolio(startPrices, numDays, volatilities, corr, market, mo, bf,
+                      weights = None, numPaths = 1, seed = None, dtype = numpy.float64):
+    rng = numpy.random.default_rng(seed)
+    startPrices = numpy.asarray(startPrices, dtype = float)
+    numAssets = len(startPrices)
+    L = correlationFactor(corr, numAssets)
+    vols = numpy.broadcast_to(numpy.asarray(volatilities, dtype = float), (numAssets,))
+    if weights is None: weights = 1.0/(numAssets*startPrices)
+    paths = numpy.empty((numPaths, numAssets, numDays+1), dtype = dtype)
+    paths[:, :, 0] = startPrices
+    if numDays > 0:
+        z = rng.standard_normal((numPaths*numDays, numAssets)) @ L.T
+        z = z.reshape(numPaths, numDays, numAssets).transpose(0, 2, 1)
+        z = z.reshape(numPaths*numAssets, numDays)
+        moves = rng.normal(0.5, 0.5, z.shape) if mo else None
+        factors = market.getCalendar(numDays) if bf else None
+        out = paths[:, :, 1:].reshape(numPaths*numAssets, numDays) if dtype == numpy.float64 \
+              else numpy.empty((numPaths*numAssets, numDays))
+        evolvePaths(out, numpy.tile(startPrices, numPaths), numpy.zeros(len(z)), 
+                    market.getDrift(), numpy.tile(vols, numPaths)[:, None], z, moves,
+                    factors, 1.0/365.0)
+        paths[:, :, 1:] = out.reshape(numPaths, numAssets, numDays)
+    portfolio = numpy.einsum('a,pad->pd', numpy.asarray(weights, dtype = float), paths)
+    return paths, portfolio
+
+# --- americanPrice ---
+# PURPOSE: prices an American option on simulated paths with the least-squares
+#          method of Longstaff and Schwartz: going back one day at a time, the
+#          value of continuing is regressed on (1, x, x^2), x = price/strike, over 
+#          the paths that are in the money, and those paths exercise where the
+#          intrinsic value is higher
+# FUNCTION: Derivative + [Arrayof Float] -> Float
+
+def americanPrice(option, paths):
+    n = option.daysLeft()
+    growth = math.exp(-option.rfrate/365.0)
+    paths = numpy.asfortranarray(paths[:, :n+1], dtype = float) #days are read one at a time
+    cash = option.intrinsic(paths[:, n])
+    for d in range(n-1, 0, -1):
+        cash *= growth
+        prices = paths[:, d]
+        exercise = option.intrinsic(prices)
+        itm = numpy.flatnonzero(exercise > 0)
+        if len(itm) < 3: continue
+        x = prices[itm]/option.strikePrice
+        basis = numpy.column_stack((numpy.ones(len(x)), x, x*x))
+        beta = numpy.linalg.lstsq(basis.T.dot(basis), basis.T.dot(cash[itm]), 
+                                  rcond = None)[0]
+        now = itm[exercise[itm] > basis.dot(beta)]
+        cash[now] = exercise[now]
+    return max(growth*cash.mean() if n else cash.mean(), 
+               float(option.intrinsic(option.stockPrice)))
+
+# --- priceBook ---
+# PURPOSE: prices a book of PutOption/CallOption instruments by Monte Carlo; the
+#          instruments on the same stock (same S, v, r and t) share one matrix
+#          of risk-neutral paths, simulated once up to the longest maturity (or
+#          the given paths are used for the whole book), and the path statistics
+#          they need are computed once per matrix. The paths are split into 
+#          replicates with independent streams (or scramblings, for sampler = 
+#          'sobol'); the price is their average and, with two or more, the 
+#          spread of the replicates gives each instrument a stdErr. Sets and 
+#          returns the prices.
+# FUNCTION: [Listof Derivative] + [Arrayof Float] + Nat + Nat + String + Nat 
+#           -> [Arrayof Float]
+
+def priceBook(book, paths = None, numPaths = 10000, seed = None, 
+              sampler = 'random', replicates = 1):
+    groups = {}
+    for i, option in enumerate(book):
+        key = (option.stockPrice, option.volatility, option.rfrate, option.curTime)
+        groups.setdefault(key if paths is None else None, []).append(i)
+    if paths is not None: replicates = 1
+    seeds = numpy.random.SeedSequence(seed).spawn(len(groups)*replicates)
+    prices = numpy.zeros((replicates, len(book)))
+    for g, (key, members) in enumerate(groups.items()):
+        for rep in range(replicates):
+            matrix = paths
+            if matrix is None:
+                S, v, r, t = key
+                numDays = max(book[i].daysLeft() for i in members)
+                matrix = simulatePaths(S, numDays, v, Market(r, []), False, False, 
+                                       numPaths//replicates, seeds[g*replicates + rep],
+                                       sampler = sampler)
+            memo = {}
+            for i in members:
+                option = book[i]
+                if option.style == 'american': prices[rep, i] = americanPrice(option, matrix)
+                else:
+                    disc = math.exp(-option.rfrate*option.daysLeft()/365.0)
+                    prices[rep, i] = disc*option.payoff(matrix, memo).mean()
+    stdErrs = prices.std(axis = 0, ddof = 1)/math.sqrt(replicates) if replicates > 1 \
+              else numpy.full(len(book), numpy.nan)
+    prices = prices.mean(axis = 0)
+    for option, price, stdErr in zip(book, prices, stdErrs):
+        option.setPrice(price)
+        option.stdErr = stdErr
+    return prices
+
+# --- hedgeBacktest ---
+# PURPOSE: backtests a delta hedge of a European option on simulated paths: the
+#          option is sold at day 0 for its Black-Scholes price (at hedgeVol, by 
+#          default the option's volatility), the hedge holds the Black-Scholes 
+#          delta in shares, rebalanced every rebalance days and unwound at 
+#          maturity, with a transaction cost of cost (a fraction of the value 
+#          traded) per trade, and the cash earns the option's rate. All paths 
+#          and days are done as array operations on blocks of blockSize paths. 
+#          Returns the hedging error (the value left at maturity) of every path
+#          and a summary of its distribution.
+# FUNCTION: Derivative + [Arrayof Float] + Nat + Float + Float + Nat 
+#           -> {String: Any}
+
+def hedgeBacktest(option, paths, rebalance = 1, cost = 0.0, hedgeVol = None, 
+                  blockSize = 10000):
+    if option.style != 'european' or option.barrier is not None:
+        raise NameError('Only plain European options can be hedged')
+    n = option.daysLeft()
+    if paths.shape[1] <= n: raise NameError('Paths are shorter than the option')
+    K, r, t0 = option.strikePrice, option.rfrate, option.curTime
+    v = option.volatility if hedgeVol is None else hedgeVol
+    kind = 'put' if isinstance(option, PutOption) else 'call'
+    days = numpy.arange(0, n, max(int(rebalance), 1))
+    # Prices are discounted to day 0, so the cash account drops out
+    disc = numpy.exp(-r*numpy.arange(n+1)/365.0)
+    errors = numpy.empty(len(paths))
+    traded = numpy.empty(len(paths))
+    for first in range(0, len(paths), blockSize):
+        block = numpy.asarray(paths[first:first+blockSize, :n+1], dtype = float)
+        S0 = block[:, 0]
+        premium = optionGreeks(S0, K, option.expiry(), r, v, t0)[kind]['price']
+        d1 = bsTerms(block[:, days], K, option.expiry(), r, v, t0 + days)[1]
+        held = phi(d1) - (kind == 'put')
+        S = block*disc
+        ends = numpy.append(days[1:], n)
+        gains = (held*(S[:, ends] - S[:, days])).sum(axis = 1)
+        trades = numpy.abs(numpy.diff(held, axis = 1, prepend = 0.0, 
+                                      append = 0.0))
+        value = (trades*S[:, numpy.append(days, n)]).sum(axis = 1)
+        payoff = option.intrinsic(block[:, n])*disc[n]
+        errors[first:first+len(block)] = (premium + gains - cost*value - payoff)/disc[n]
+        traded[first:first+len(block)] = value/disc[n]
+    levels = (1, 5, 50, 95, 99)
+    return {'errors': errors, 'mean': errors.mean(), 'std': errors.std(), 
+            'quantiles': dict(zip(levels, numpy.percentile(errors, levels))),
+            'costs': cost*traded.mean(), 'rebalances': len(days)}
+
+# COMMAND LINE -----------------------------------------------------------------
+
+# --- main ---
+# PURPOSE: runs an ensemble from the command line, e.g.
+#          python stock_simulator.py --paths 10000 --days 1460 --bf --out runs/abc
+#          and prints the statistics of the closing prices as JSON; with --out
+#          the paths are also written to a path store (see stock_store)
+# FUNCTION: [Listof String] -> (Void)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Run a stock simulation.')
+    parser.add_argument('--paths', type = int, default = 1)
+    parser.add_argument('--days', type = int, default = 365)
+    parser.add_argument('--start', type = float, default = 1000.0)
+    parser.add_argument('--vol', type = float, default = 0.3)
+    parser.add_argument('--drift', type = float, default = 0.04)
+    parser.add_argument('--mo', action = 'store_true')
+    parser.add_argument('--bf', action = 'store_true')
+    parser.add_argument('--seed', type = int, default = None)
+    parser.add_argument('--workers', type = int, default = 1)
+    parser.add_argument('--block', type = int, default = 1000)
+    parser.add_argument('--float32', action = 'store_true')
+    parser.add_argument('--out', default = None, help = 'path store to write')
+    parser.add_argument('--profile', default = None, 
+                        help = 'write a profile of the run (see stock_profile) here; '
+                               'with --workers > 1 the simulation stages run in '
+                               'the workers and are not timed')
+    parser.add_argument('--cprofile', action = 'store_true', 
+                        help = 'add cProfile hot spots to the profile')
+    args = parser.parse_args(argv)
+    if args.out:
+        from stock_store import savePaths, openPaths
+    if args.profile:
+        from stock_profile import Profiler
+        prof = Profiler(memory = True, profile = args.cprofile).start()
+    market = Market(args.drift, defaultTrends(args.vol))
+    dtype = numpy.float32 if args.float32 else numpy.float64
+    if args.out:
+        meta = savePaths(args.out, args.paths, args.start, args.days, args.vol, 
+                         market, args.mo, args.bf, args.seed, args.workers, 
+                         args.block, dtype)
+        stats = dict(closingStats(openPaths(args.out)[0]), seed = meta['seed'])
+    else:
+        stats = runEnsemble(args.paths, args.start, args.days, args.vol, market,
+                            args.mo, args.bf, args.seed, args.workers, args.block,
+                            dtype)[1]
+    if args.profile: prof.stop().save(args.profile)
+    json.dump(stats, sys.stdout, indent = 1)
+    sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# Stock Market Simulation
+
+# Here we keep simulated stock paths on disk so that a large ensemble only has
+# to be simulated once; the prices are stored as a .npy matrix (one row per path)
+# that is reopened as a read-only memory map, next to a .json file holding the
+# parameters of the run
+
+import json, numpy, os
+from stock_classes import *
+from stock_simulator import *
+
+# PATH STORE -------------------------------------------------------------------
+
+# --- storeFiles ---
+# PURPOSE: gives the names of the matrix and metadata files of a path store
+# FUNCTION: String -> String + String
+
+def storeFiles(fileName):
+    if fileName.endswith('.npy'): fileName = fileName[:-4]
+    return fileName + '.npy', fileName + '.json'
+
+# --- savePaths ---
+# PURPOSE: simulates an ensemble with ensembleBlocks and writes it block by
+#          block into a memory mapped matrix, so only one block is held in
+#          memory at a time; the paths are the same as runEnsemble with the
+#          same seed and blockSize. Returns the metadata that was saved.
+# FUNCTION: String + Nat + Float + Nat + Float + Market + Boolean + Boolean +
+#           Nat + Nat + Nat -> {String: Any}
+
+def savePaths(fileName, numPaths, startPrice, numDays, volatility, market, mo, bf,
+              seed = None, numWorkers = 1, blockSize = 1000, dtype = numpy.float64):
+    if seed is None: seed = numpy.random.SeedSequence().entropy
+    matFile, metaFile = storeFiles(fileName)
+    os.makedirs(os.path.dirname(matFile) or '.', exist_ok = True)
+    paths = numpy.lib.format.open_memmap(matFile, mode = 'w+', dtype = dtype,
+                                         shape = (numPaths, numDays+1))
+    first = 0
+    for block in ensembleBlocks(numPaths, startPrice, numDays, volatility, market,
+                                mo, bf, seed, numWorkers, blockSize, dtype):
+        paths[first:first+len(block)] = block
+        first += len(block)
+    paths.flush()
+    del paths
+    meta = {'S0': startPrice, 'volatility': numpy.asarray(volatility).tolist(),
+            'drift': market.getDrift(), 'mo': mo, 'bf': bf, 'seed': seed,
+            'days': numDays, 'paths': numPaths, 'blockSize': blockSize,
+            'dtype': numpy.dtype(dtype).name, 'yearLength': market.yearLength,
+            'lead': market.lead, 'trends': [[t.name, t.day, t.factor, t.year]
+                                            for t in market.getTrends()]}
+    with open(metaFile, 'w') as f:
+        json.dump(meta, f, indent = 1)
+    return meta
+
+# --- openPaths ---
+# PURPOSE: reopens a path store without reading it into memory; rows of the
+#          returned matrix can be handed to putPrice, callPrice, plotStock or
+#          plotOptions as they are
+# FUNCTION: String -> [Arrayof Float] + {String: Any}
+
+def openPaths(fileName):
+    matFile, metaFile = storeFiles(fileName)
+    with open(metaFile) as f:
+        meta = json.load(f)
+    return numpy.load(matFile, mmap_mode = 'r'), meta
+
+# --- storeMarket ---
+# PURPOSE: rebuilds the Market that a path store was simulated in
+# FUNCTION: {String: Any} -> Market
+
+def storeMarket(meta):
+    trends = [Trend(name, day, factor, year) for name, day, factor, year in meta['trends']]
+    return Market(meta['drift'], trends, meta['yearLength'], meta['lead'])
@@ -0,0 +1,35 @@
+# Regression tests for the memo of Black-Scholes prices
+
+import numpy
+from stock_classes import *
+
+def test_prices_match_optionPrices():
+    cache = PricingCache()
+    S = numpy.linspace(900.0, 1100.0, 7)
+    put, call = cache.prices(S, 1013.4, 121.7, 0.04, 0.3)
+    expected = optionPrices(S, 1013.4, 121.7, 0.04, 0.3)
+    numpy.testing.assert_allclose(put, expected[0], rtol = 1e-8)
+    numpy.testing.assert_allclose(call, expected[1], rtol = 1e-8)
+    # scalars find the entries that arrays stored, and give the same prices
+    assert cache.prices(float(S[3]), 1013.4, 121.7, 0.04, 0.3) == (put[3], call[3])
+    assert cache.stats()['hits'] == 1
+
+def test_duplicates_are_priced_and_counted_once():
+    cache = PricingCache()
+    K = numpy.array([[1000.0, 1010.0], [1010.0, 1000.0]])
+    put, call = cache.prices(1000.0, K, 120.0, 0.04, 0.3)
+    assert put.shape == call.shape == (2, 2)
+    assert put[0, 0] == put[1, 1] and call[0, 1] == call[1, 0]
+    assert cache.stats()['misses'] == 2 and cache.stats()['size'] == 2
+
+def test_lru_evicts_the_oldest_entry():
+    cache = PricingCache(maxSize = 3)
+    for K in (1000.0, 1010.0, 1020.0): cache.prices(1000.0, K, 120.0, 0.04, 0.3)
+    cache.prices(1000.0, 1000.0, 120.0, 0.04, 0.3)
+    cache.prices(1000.0, 1030.0, 120.0, 0.04, 0.3)
+    assert [key[1] for key in cache.entries] == [1020.0, 1000.0, 1030.0]
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['size']) == (1, 4, 1, 3)
+    assert stats['hitRate'] == 0.2
+    cache.clear()
+    assert cache.stats()['size'] == cache.stats()['misses'] == 0
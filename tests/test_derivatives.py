@@ -0,0 +1,41 @@
+# Regression tests for the derivatives and their Monte Carlo prices
+
+import math, numpy, pytest
+from stock_classes import *
+
+def test_american_options_have_no_barrier():
+    with pytest.raises(NameError):
+        PutOption(1000.0, 1000.0, 120.0, 0.04, 0.3, style = 'american', barrier = 900.0)
+
+def binomialAmerican(S, K, days, r, v, kind):
+    # Cox-Ross-Rubinstein tree with one step per day
+    dt = 1.0/365.0
+    up = math.exp(v*math.sqrt(dt))
+    p = (math.exp(r*dt) - 1.0/up)/(up - 1.0/up)
+    disc = math.exp(-r*dt)
+    prices = S*up**numpy.arange(days, -days - 1, -2.0)
+    value = numpy.maximum(kind*(prices - K), 0.0)
+    for n in range(days, 0, -1):
+        prices = prices[1:]*up
+        value = numpy.maximum(disc*(p*value[:-1] + (1.0 - p)*value[1:]), 
+                              kind*(prices - K))
+    return value[0]
+
+def test_knock_in_and_knock_out_make_the_vanilla():
+    from stock_simulator import priceBook
+    for barrier in (900.0, 1150.0):
+        book = [CallOption(1000.0, 1000.0, 121.0, 0.04, 0.3),
+                CallOption(1000.0, 1000.0, 121.0, 0.04, 0.3, barrier = barrier, knockIn = True),
+                CallOption(1000.0, 1000.0, 121.0, 0.04, 0.3, barrier = barrier)]
+        vanilla, knockIn, knockOut = priceBook(book, numPaths = 4000, seed = 1)
+        assert knockIn > 0 and knockOut > 0
+        assert abs(knockIn + knockOut - vanilla) < 1e-9*vanilla
+
+def test_american_put_matches_binomial_tree():
+    from stock_simulator import priceBook
+    american = PutOption(1000.0, 1100.0, 121.0, 0.04, 0.3, style = 'american')
+    european = PutOption(1000.0, 1100.0, 121.0, 0.04, 0.3)
+    tree = binomialAmerican(1000.0, 1100.0, 121, 0.04, 0.3, -1.0)
+    price = priceBook([american], numPaths = 20000, seed = 3)[0]
+    assert tree > european.getPrice()
+    assert abs(price - tree) < 0.01*tree
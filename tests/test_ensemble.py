@@ -0,0 +1,28 @@
+# Regression tests for the parallel ensemble runner: the paths must only depend
+# on the seed and the block size, never on the number of workers
+
+import numpy, pytest
+from stock_classes import *
+from stock_simulator import *
+
+@pytest.mark.parametrize('mo', [False, True])
+def test_runEnsemble_ignores_numWorkers(mo):
+    market = Market(0.04, defaultTrends(0.3))
+    runs = [runEnsemble(50, 1000.0, 60, 0.3, market, mo, True, seed = 3, 
+                        numWorkers = workers, blockSize = 8)
+            for workers in (1, 3)]
+    numpy.testing.assert_array_equal(runs[0][0], runs[1][0])
+    assert runs[0][1] == runs[1][1]
+
+def test_runEnsemble_blocks_and_stats():
+    market = Market(0.04, [])
+    vols = numpy.linspace(0.1, 0.5, 25)
+    paths, stats = runEnsemble(25, 1000.0, 30, vols, market, False, False, seed = 4, 
+                               blockSize = 10)
+    assert paths.shape == (25, 31)
+    # every block has its own stream, so the blocks are not copies of each other
+    assert not numpy.array_equal(paths[:10, 1:]/paths[:10, :-1], paths[10:20, 1:]/paths[10:20, :-1])
+    assert stats['mean'] == pytest.approx(paths[:, -1].mean())
+    assert stats['min'] <= stats['median'] <= stats['max']
+    numpy.testing.assert_array_equal(paths, runEnsemble(25, 1000.0, 30, vols, market, False, 
+                                                        False, seed = 4, blockSize = 10)[0])
@@ -0,0 +1,25 @@
+# Regression tests for the analytic Greeks against the closed forms of
+# test_pricing
+
+import numpy, pytest
+from stock_classes import *
+from test_pricing import contracts, reference
+
+def test_greeks_match_closed_forms():
+    S, K, T, r, v, t = [numpy.array(a) for a in zip(*contracts)]
+    greeks = optionGreeks(S, K, T, r, v, t)
+    for i, contract in enumerate(contracts):
+        expected = reference(*contract)
+        for kind in ('put', 'call'):
+            for name, value in expected[kind].items():
+                assert greeks[kind][name][i] == pytest.approx(value, rel = 1e-9, abs = 1e-12)
+
+def test_greeks_match_finite_differences():
+    S, K, T, r, v = 1000.0, 1013.42, 121.67, 0.04, 0.3
+    greeks = optionGreeks(S, K, T, r, v)
+    h = 1e-3
+    for kind, pricer in (('put', putPrice), ('call', callPrice)):
+        delta = (pricer(S + h, K, T, r, v) - pricer(S - h, K, T, r, v))/(2*h)
+        vega = (pricer(S, K, T, r, v + h) - pricer(S, K, T, r, v - h))/(2*h)
+        assert float(greeks[kind]['delta']) == pytest.approx(delta, rel = 1e-6)
+        assert float(greeks[kind]['vega']) == pytest.approx(vega, rel = 1e-6)
@@ -0,0 +1,31 @@
+# Regression tests for the delta hedging backtest
+
+import math, numpy, pytest
+from stock_classes import *
+from stock_simulator import *
+
+option = CallOption(1000.0, 1013.4, 121.0, 0.04, 0.3)
+paths = simulatePaths(1000.0, 121, 0.3, Market(0.04, []), False, False, 4000, seed = 8)
+
+def test_error_shrinks_with_more_rebalancing():
+    results = [hedgeBacktest(option, paths, rebalance) for rebalance in (20, 5, 1)]
+    stds = [result['std'] for result in results]
+    assert stds[0] > stds[1] > stds[2]
+    # the error of a discrete hedge falls like the square root of the step
+    assert stds[2] < 0.6*stds[1]
+    assert [result['rebalances'] for result in results] == [7, 25, 121]
+    for result in results:
+        assert abs(result['mean']) < 4*result['std']/math.sqrt(len(paths))
+
+def test_costs_are_paid_out_of_the_hedge():
+    free, costly = hedgeBacktest(option, paths, 1), hedgeBacktest(option, paths, 1, cost = 0.001)
+    assert costly['costs'] > 0
+    assert free['mean'] - costly['mean'] == pytest.approx(costly['costs'], rel = 1e-9)
+
+def test_only_plain_european_options_are_hedged():
+    for other in (PutOption(1000.0, 1000.0, 121.0, 0.04, 0.3, style = 'asian'),
+                  CallOption(1000.0, 1000.0, 121.0, 0.04, 0.3, barrier = 1200.0)):
+        with pytest.raises(NameError):
+            hedgeBacktest(other, paths)
+    with pytest.raises(NameError):
+        hedgeBacktest(CallOption(1000.0, 1000.0, 200.0, 0.04, 0.3), paths)
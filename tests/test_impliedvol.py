@@ -0,0 +1,25 @@
+# Regression tests for the implied volatility solver
+
+import numpy
+from stock_classes import *
+from test_pricing import contracts
+
+def test_impliedVol_round_trip():
+    S, K, T, r, v, t = [numpy.array(a) for a in zip(*contracts)]
+    sigma, converged = impliedVol(callPrice(S, K, T, r, v, t), S, K, T, r, t)
+    # the last call is so deep in the money that its price barely depends on v
+    assert converged.tolist() == [True, True, True, False]
+    numpy.testing.assert_allclose(sigma[:3], v[:3], atol = 1e-6)
+
+def test_impliedVol_of_a_mixed_chain():
+    K = numpy.linspace(800.0, 1200.0, 41)
+    v = 0.2 + 0.2*((K - 1000.0)/400.0)**2
+    kind = numpy.where(K < 1000.0, 'put', 'call')
+    prices = numpy.where(kind == 'put', putPrice(1000.0, K, 90.0, 0.04, v),
+                         callPrice(1000.0, K, 90.0, 0.04, v))
+    sigma, converged = impliedVol(prices, 1000.0, K, 90.0, 0.04, kind = kind)
+    assert converged.all()
+    numpy.testing.assert_allclose(sigma, v, atol = 1e-6)
+    # prices below the intrinsic value have no volatility
+    sigma, converged = impliedVol(numpy.array([1.0]), 1000.0, 800.0, 90.0, 0.04)
+    assert not converged[0]
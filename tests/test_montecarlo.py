@@ -0,0 +1,34 @@
+# Regression tests for the variance-reduced Monte Carlo estimator
+
+import math, numpy, pytest
+from stock_classes import *
+
+market = Market(0.04, [])
+stock = NewStock('T', 1000.0, 0.3, 0)
+
+@pytest.mark.parametrize('kind, exact', [
+    (None, 1000.0*math.exp(0.04*120.0/365.0)),
+    ('log', math.log(1000.0) + (0.04 - 0.3**2/2)*120.0/365.0),
+    ('call', callPrice(1000.0, 1050.0, 120.0, 0.04, 0.3)),
+    ('put', putPrice(1000.0, 1050.0, 120.0, 0.04, 0.3))])
+@pytest.mark.parametrize('sampler', ['random', 'sobol'])
+def test_estimates_cover_the_exact_value(kind, exact, sampler):
+    result = mcStockPrice(stock, 120.0, market, 1050.0, kind, targetErr = 0.05, 
+                          maxSamples = 200000, seed = 5, sampler = sampler)
+    assert result['converged'] and result['stdErr'] <= 0.05
+    assert abs(result['estimate'] - exact) < 4*result['stdErr'] + 1e-9
+    assert result['ci'][0] <= result['estimate'] <= result['ci'][1]
+
+def test_controls_reduce_the_error():
+    errors = [mcStockPrice(stock, 120.0, market, 1100.0, lambda s: numpy.maximum(s - 1100.0, 0.0)**2,
+                           targetErr = 0.0, maxSamples = 20000, controls = controls, 
+                           seed = 5)['stdErr'] for controls in (False, True)]
+    assert errors[1] < 0.5*errors[0]
+
+def test_sampling_is_bounded():
+    result = mcStockPrice(stock, 120.0, market, kind = 'call', targetErr = 0.0, 
+                          batchSize = 1000, maxSamples = 5000, seed = 5)
+    assert result['samples'] <= 5000 and not result['converged']
+    with pytest.raises(NameError):
+        mcStockPrice(stock, 120.0, market, maxSamples = 3)
+    assert stockPrice(stock, 120.0, market, 20000) == pytest.approx(stockPrice(stock, 120.0, market), rel = 1e-3)
@@ -0,0 +1,29 @@
+# Regression tests for the headless plotting path
+
+import os, sys
+import matplotlib
+matplotlib.use('Agg')
+from stock_plot import *
+
+def test_saveFigure_keeps_bf_annotations(tmp_path):
+    market = Market(0.04, defaultTrends(0.3))
+    drawn = []
+    def draw(fig):
+        plotStock('A', 1000.0, 800, 0.3, market, False, True, fig)
+        drawn.append(fig)
+    fileName = str(tmp_path/'stock.png')
+    saveFigure(fileName, draw)
+    assert os.path.getsize(fileName) > 0
+    assert len(drawn[0].axes[0].texts) == len(market.getEvents(800)) > 0
+    # nothing was drawn on a pyplot figure instead
+    if 'matplotlib.pyplot' in sys.modules:
+        assert sys.modules['matplotlib.pyplot'].get_fignums() == []
+
+def test_decimate_keeps_endpoints_and_budget():
+    paths = numpy.cumsum(numpy.random.default_rng(0).standard_normal((20, 10001)), axis = 1)
+    days, prices = decimate(paths, 100)
+    assert prices.shape[1] <= 100
+    numpy.testing.assert_array_equal(prices[:, 0], paths[:, 0])
+    numpy.testing.assert_array_equal(prices[:, -1], paths[:, -1])
+    numpy.testing.assert_array_equal(prices.max(axis = 1), paths.max(axis = 1))
+    numpy.testing.assert_array_equal(prices.min(axis = 1), paths.min(axis = 1))
@@ -0,0 +1,66 @@
+# Regression tests for the Black-Scholes prices against closed forms that are
+# written out here with math, and against textbook values
+
+import math, numpy, pytest
+from stock_classes import *
+
+# --- reference ---
+# PURPOSE: the Black-Scholes put, call and greeks of one contract, with math
+#          (theta per day, vega and rho per unit)
+# FUNCTION: Float + Float + Float + Float + Float + Float -> {String: {String: Float}}
+
+def reference(S, K, T, r, v, t = 0.0):
+    N = lambda x: 0.5*(1.0 + math.erf(x/math.sqrt(2.0)))
+    n = lambda x: math.exp(-x*x/2.0)/math.sqrt(2.0*math.pi)
+    tau = (T - t)/365.0
+    d1 = (math.log(S/K) + (r + v*v/2.0)*tau)/(v*math.sqrt(tau))
+    d2 = d1 - v*math.sqrt(tau)
+    disc = math.exp(-r*tau)
+    common = {'gamma': n(d1)/(S*v*math.sqrt(tau)), 'vega': S*n(d1)*math.sqrt(tau)}
+    decay = -S*n(d1)*v/(2.0*math.sqrt(tau))
+    call = dict(common, price = S*N(d1) - K*disc*N(d2), delta = N(d1), 
+                theta = (decay - r*K*disc*N(d2))/365.0, rho = K*tau*disc*N(d2))
+    put = dict(common, price = K*disc*N(-d2) - S*N(-d1), delta = N(d1) - 1.0,
+               theta = (decay + r*K*disc*N(-d2))/365.0, rho = -K*tau*disc*N(-d2))
+    return {'put': put, 'call': call}
+
+contracts = [(100.0, 100.0, 365.0, 0.05, 0.2, 0.0), (1000.0, 1013.42, 121.67, 0.04, 0.3, 0.0),
+             (50.0, 80.0, 700.0, 0.01, 0.6, 100.0), (150.0, 90.0, 10.0, 0.08, 0.1, 0.0)]
+
+def test_textbook_values():
+    put, call = optionPrices(100.0, 100.0, 365.0, 0.05, 0.2)
+    assert call == pytest.approx(10.4506, abs = 1e-4)
+    assert put == pytest.approx(5.5735, abs = 1e-4)
+
+@pytest.mark.parametrize('contract', contracts)
+def test_scalar_prices(contract):
+    expected = reference(*contract)
+    assert putPrice(*contract) == pytest.approx(expected['put']['price'], abs = 1e-10)
+    assert callPrice(*contract) == pytest.approx(expected['call']['price'], abs = 1e-10)
+    put, call = optionPrices(*contract)
+    assert put == pytest.approx(expected['put']['price'], abs = 1e-10)
+    assert call == pytest.approx(expected['call']['price'], abs = 1e-10)
+
+def test_array_prices():
+    S, K, T, r, v, t = [numpy.array(a) for a in zip(*contracts)]
+    put, call = putPrice(S, K, T, r, v, t), callPrice(S, K, T, r, v, t)
+    for i, contract in enumerate(contracts):
+        expected = reference(*contract)
+        assert put[i] == pytest.approx(expected['put']['price'], abs = 1e-10)
+        assert call[i] == pytest.approx(expected['call']['price'], abs = 1e-10)
+
+def test_arrays_broadcast():
+    K = numpy.linspace(80.0, 120.0, 5)
+    T = numpy.array([[30.0], [365.0]])
+    put, call = optionPrices(100.0, K, T, 0.05, 0.2)
+    assert put.shape == call.shape == (2, 5)
+    for i in range(2):
+        for j in range(5):
+            assert call[i, j] == pytest.approx(callPrice(100.0, K[j], T[i, 0], 0.05, 0.2), abs = 1e-10)
+            assert put[i, j] == pytest.approx(putPrice(100.0, K[j], T[i, 0], 0.05, 0.2), abs = 1e-10)
+    x = numpy.linspace(-8.0, 8.0, 33)
+    numpy.testing.assert_allclose(phi(x), [phi(float(y)) for y in x], atol = 1e-14)
+
+def test_prices_at_maturity_are_intrinsic():
+    assert putPrice(90.0, 100.0, 30.0, 0.04, 0.3, 30.0) == pytest.approx(10.0)
+    assert callPrice(90.0, 100.0, 30.0, 0.04, 0.3, 30.0) == 0.0
@@ -0,0 +1,37 @@
+# Regression tests for the Sobol points and the Brownian bridge
+
+import numpy, pytest
+from stock_qmc import *
+
+def test_unscrambled_points_start_like_van_der_corput():
+    points = sobolPoints(8, 2, scramble = False)
+    numpy.testing.assert_allclose(points[:, 0], [0, 0.5, 0.25, 0.75, 0.125, 0.625, 0.375, 0.875],
+                                  atol = 1e-9)
+
+@pytest.mark.parametrize('seed', [None, 0, 1])
+def test_points_are_stratified(seed):
+    # every one dimensional projection of 2^m points has one point per 1/2^m
+    points = sobolPoints(256, 20, seed, scramble = seed is not None)
+    assert points.shape == (256, 20) and (points > 0).all() and (points < 1).all()
+    for d in range(20):
+        assert numpy.array_equal(numpy.sort(numpy.floor(points[:, d]*256)), numpy.arange(256))
+    # and the first two dimensions have one point per square of side 1/16
+    cells = numpy.floor(points[:, 0]*16)*16 + numpy.floor(points[:, 1]*16)
+    assert len(numpy.unique(cells)) == 256
+
+def test_scramblings_differ():
+    assert not numpy.array_equal(sobolPoints(64, 3, 1), sobolPoints(64, 3, 2))
+    numpy.testing.assert_array_equal(sobolPoints(64, 3, 1), sobolPoints(64, 3, 1))
+
+def test_bridge_keeps_independent_normals():
+    n = 37
+    M = bridgeIncrements(numpy.eye(n))
+    numpy.testing.assert_allclose(M.dot(M.T), numpy.eye(n), atol = 1e-12)
+    # the first normal alone sets the end point of the path
+    numpy.testing.assert_allclose(M.sum(axis = 1), numpy.eye(n)[0]*numpy.sqrt(n), atol = 1e-12)
+
+def test_sobolNormals():
+    z = sobolNormals(4096, 50, seed = 3, sobolDims = 10)
+    assert z.shape == (4096, 50)
+    assert abs(z.mean()) < 0.01 and abs(z.std() - 1.0) < 0.01
+    numpy.testing.assert_array_equal(z, sobolNormals(4096, 50, seed = 3, sobolDims = 10))
@@ -0,0 +1,17 @@
+# Regression tests for the scenario sweeps
+
+from stock_scenarios import *
+
+def test_runScenario_prices_both_ways_at_the_expiry():
+    result = runScenario({'numStks': 20, 'numDays': 30, 'months': 1.3})
+    assert result['expiry'] == 40 != result['maturity']
+    put, call = optionPrices(1000.0, result['strike'], 40, 0.04, 0.3)
+    assert result['blackScholes'] == {'put': put, 'call': call}
+
+def test_runScenarios_reuses_cached_results(tmp_path):
+    scenarios = scenarioGrid({'volatility': [0.2, 0.3], 'numStks': [5], 'numDays': [30]})
+    first, counts = runScenarios(scenarios, str(tmp_path))
+    assert counts == {'scenarios': 2, 'cached': 0, 'run': 2}
+    again, counts = runScenarios(scenarios + scenarios[:1], str(tmp_path))
+    assert counts == {'scenarios': 3, 'cached': 3, 'run': 0}
+    assert [result for params, result in again[:2]] == [result for params, result in first]
@@ -0,0 +1,38 @@
+# Regression tests for the pricing service, run without a socket
+
+import asyncio, json, pytest
+from stock_service import *
+
+class Writer(object):
+    def __init__(self):
+        self.lines = []
+    def write(self, data):
+        self.lines.append(data.decode())
+
+def answers(requests, **options):
+    async def run():
+        service, writer = PricingService(**options), Writer()
+        await asyncio.gather(*[service.answer(json.dumps(dict(request, id = i)), writer)
+                               for i, request in enumerate(requests)])
+        return service, sorted((json.loads(line) for line in writer.lines),
+                               key = lambda reply: reply['id'])
+    return asyncio.run(run())
+
+def test_batched_prices_match_optionPrices():
+    service, replies = answers([{'kind': kind, 'S': 1000, 'K': K, 'T': 121.7, 'r': 0.04, 'v': 0.3}
+                                for K in (900, 1000, 1100) for kind in ('put', 'call', 'both')],
+                               maxBatch = 4)
+    assert service.stats()['batches'] == 3 and service.errors == 0
+    for i, K in enumerate((900, 1000, 1100)):
+        put, call = optionPrices(1000.0, float(K), 121.7, 0.04, 0.3)
+        assert [reply['price'] for reply in replies[3*i:3*i+2]] == pytest.approx([put, call])
+        assert (replies[3*i+2]['put'], replies[3*i+2]['call']) == pytest.approx((put, call))
+
+def test_bad_and_overflowing_requests_get_errors():
+    good = {'S': 1000, 'K': 1000, 'T': 120, 'r': 0.04, 'v': 0.3}
+    service, replies = answers([good, dict(good, v = -0.3), dict(good, kind = 'swap'),
+                                {'S': 1000}, dict(good, S = 1.0, K = 1.0, T = 1e308, r = 1e308, v = 1e308)])
+    assert 'put' in replies[0]
+    assert [reply['error'] for reply in replies[1:]] == ['Bad v', 'No such option', 'Missing K',
+                                                        'Price is not finite']
+    assert service.errors == 4
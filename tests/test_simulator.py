@@ -0,0 +1,52 @@
+# Regression tests for the path engine: the vectorized paths must follow the
+# original NewStock.makeMove loop
+
+import numpy, pytest
+import stock_classes
+from stock_classes import *
+from stock_simulator import *
+
+# --- loopPaths ---
+# PURPOSE: the original day by day simulation (runStockSim before the path
+#          engine), fed with the given shocks instead of random.gauss
+# FUNCTION: Float + Float + Market + Boolean + Boolean + [Arrayof Float] 
+#           + [Arrayof Float] -> [Arrayof Float]
+
+def loopPaths(monkeypatch, startPrice, vol, market, mo, bf, z, moves):
+    paths = []
+    for i in range(len(z)):
+        draws = iter(numpy.column_stack((z[i], moves[i])).ravel() if mo else z[i])
+        monkeypatch.setattr(stock_classes.random, 'gauss', lambda mu, sigma: next(draws))
+        stock = NewStock('T', startPrice, vol, len(z[i]))
+        for d in range(len(z[i])):
+            if bf:
+                for date in market.getTrends():
+                    if date.day - 7 == d % 365: stock.price *= (1 + date.factor)
+            stock.makeMove(market.getDrift(), mo)
+        paths.append(stock.history)
+    return numpy.array(paths)
+
+@pytest.mark.parametrize('mo', [False, True])
+@pytest.mark.parametrize('bf', [False, True])
+@pytest.mark.parametrize('numPaths', [1, 20]) # one stock at a time, and in numpy
+def test_evolvePaths_matches_makeMove(monkeypatch, mo, bf, numPaths):
+    numDays, vol = 800, 0.3
+    market = Market(0.04, defaultTrends(vol))
+    rng = numpy.random.default_rng(2011)
+    z = rng.standard_normal((numPaths, numDays))
+    moves = rng.normal(0.5, 0.5, (numPaths, numDays))
+    expected = loopPaths(monkeypatch, 1000.0, vol, market, mo, bf, z, moves)
+    paths = numpy.empty((numPaths, numDays+1))
+    paths[:, 0] = 1000.0
+    evolvePaths(paths[:, 1:], numpy.full(numPaths, 1000.0), numpy.zeros(numPaths),
+                market.getDrift(), vol, z, moves if mo else None,
+                market.getCalendar(numDays) if bf else None, 1.0/365.0)
+    numpy.testing.assert_allclose(paths, expected, rtol = 1e-11)
+
+def test_simulatePaths_is_reproducible():
+    market = Market(0.04, defaultTrends(0.3))
+    first = simulatePaths(1000.0, 100, 0.3, market, True, True, 10, seed = 7)
+    assert first.shape == (10, 101)
+    assert (first[:, 0] == 1000.0).all()
+    numpy.testing.assert_array_equal(first, simulatePaths(1000.0, 100, 0.3, market,
+                                                          True, True, 10, seed = 7))
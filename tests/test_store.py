@@ -0,0 +1,20 @@
+# Regression tests for the on-disk path store
+
+import numpy
+from stock_classes import *
+from stock_simulator import *
+from stock_store import *
+
+def test_openPaths_matches_runEnsemble(tmp_path):
+    market = Market(0.04, defaultTrends(0.3))
+    fileName = str(tmp_path/'runs'/'ensemble')
+    meta = savePaths(fileName, 30, 1000.0, 90, 0.3, market, True, True, seed = 6,
+                     blockSize = 8)
+    paths, saved = openPaths(fileName + '.npy')
+    assert isinstance(paths, numpy.memmap) and not paths.flags.writeable
+    assert saved == meta
+    numpy.testing.assert_array_equal(paths, runEnsemble(30, 1000.0, 90, 0.3, market, True,
+                                                        True, seed = 6, blockSize = 8)[0])
+    rebuilt = storeMarket(saved)
+    numpy.testing.assert_array_equal(rebuilt.getCalendar(400), market.getCalendar(400))
+    assert rebuilt.getDrift() == market.getDrift()
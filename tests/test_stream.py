@@ -0,0 +1,29 @@
+# Regression tests for the streaming simulator
+
+import itertools, math, numpy
+from stock_classes import *
+from stock_simulator import *
+
+def test_one_chunk_is_simulatePaths():
+    market = Market(0.04, defaultTrends(0.3))
+    chunks = list(streamStockSim(1000.0, 0.3, market, True, True, 200, 5, 
+                                 chunkSize = 200, seed = 9))
+    assert len(chunks) == 1
+    paths = simulatePaths(1000.0, 200, 0.3, market, True, True, 5, seed = 9)
+    numpy.testing.assert_allclose(chunks[0], paths[:, 1:], rtol = 1e-12)
+
+def test_chunks_carry_the_state():
+    # without volatility every tick grows the price by the same factor
+    ticks = numpy.concatenate(list(streamStockSim(1000.0, 0.0, Market(0.04, []), False, 
+                                                  False, 100, 2, chunkSize = 7,
+                                                  ticksPerDay = 4, seed = 1)), axis = 1)
+    assert ticks.shape == (2, 400)
+    expected = 1000.0*numpy.exp(0.04*numpy.arange(1, 401)/(365.0*4))
+    numpy.testing.assert_allclose(ticks, [expected, expected], rtol = 1e-12)
+
+def test_unbounded_stream_is_lazy():
+    stream = streamStockSim(1000.0, 0.3, Market(0.04, defaultTrends(0.3)), True, True,
+                            chunkSize = 365, seed = 2)
+    chunks = list(itertools.islice(stream, 12))
+    assert [chunk.shape for chunk in chunks] == [(1, 365)]*12
+    assert (numpy.concatenate(chunks, axis = 1) >= 0.0).all()